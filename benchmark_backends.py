@@ -0,0 +1,71 @@
+"""
+benchmark_backends.py
+30. January 2025
+
+Compares the speed of all available compute backends on the solver's
+array sizes (parity is checked by tests/test_backends.py)
+
+Author:
+Nilusink
+"""
+from time import perf_counter
+import typing as tp
+
+import numpy as np
+
+from core.maths import select_backend, available_backends, solve_rays
+
+
+N_CALLS: int = 20_000
+N_SOLVES: int = 1_000
+N_CAMS: int = 3
+
+
+def random_rays(rng: np.random.Generator, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    rays from around the origin towards a target at roughly 100 m
+    """
+    target = rng.uniform(-100, 100, 3) + (0, 0, 100)
+    origins = rng.uniform(-50, 50, (n, 3)) * (1, 1, 0)
+    directions = target - origins + rng.normal(0, .5, (n, 3))
+    return origins, directions
+
+
+def timed(call: tp.Callable[[], tp.Any], n: int) -> float:
+    """
+    µs per call
+    """
+    start = perf_counter()
+    for _ in range(n):
+        call()
+
+    return (perf_counter() - start) / n * 1e6
+
+
+def measure(name: str, rng: np.random.Generator) -> None:
+    backend = select_backend(name)
+
+    angles = rng.uniform(-np.pi, np.pi, (N_CAMS, 2))
+    origins, directions = random_rays(rng, N_CAMS)
+    point = np.zeros(3)
+
+    print(
+        f"{name: <8}"
+        f" polar {timed(lambda: backend.polar_to_cartesian(angles[:, 0], angles[:, 1], 100.), N_CALLS): >7.2f} µs"
+        f" distances {timed(lambda: backend.line_distances(point, origins, directions), N_CALLS): >7.2f} µs"
+        f" objective {timed(lambda: backend.objective(point, origins, directions), N_CALLS): >7.2f} µs"
+        f" solve {timed(lambda: solve_rays(origins, directions), N_SOLVES): >8.1f} µs"
+    )
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    names = available_backends()
+
+    print(f"{', '.join(names)}, {N_CAMS} cameras")
+    for name in names:
+        measure(name, rng)
+
+
+if __name__ == '__main__':
+    main()
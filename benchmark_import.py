@@ -0,0 +1,74 @@
+"""
+benchmark_import.py
+17. January 2025
+
+Measures the cold start time of the core package, every statement runs
+in a fresh interpreter. Exits with an error if a budget is exceeded.
+
+Author:
+Nilusink
+"""
+from statistics import median
+import subprocess
+import sys
+
+
+REPEATS: int = 5
+
+# statement: (budget in seconds, modules that must not be loaded)
+CASES: dict[str, tuple[float, tuple[str, ...]]] = {
+    "import core": (.05, ("numpy", "pydantic", "scipy")),
+    "from core import decode_push": (1., ("scipy",)),
+    "from core import DataServer, TrackingMaster, FrameAssembler": (1.5, ("scipy",)),
+    "from core import solve_rays; import numpy as np; "
+    "solve_rays(np.eye(3), np.ones((3, 3)))": (2.5, ()),
+}
+
+PROGRAM: str = """
+from time import perf_counter
+import sys
+start = perf_counter()
+{statement}
+took = perf_counter() - start
+print(took, *(m for m in {forbidden!r} if m in sys.modules))
+"""
+
+
+def run(statement: str, forbidden: tuple[str, ...]) -> tuple[float, list[str]]:
+    out = subprocess.run(
+        [sys.executable, "-c", PROGRAM.format(statement=statement, forbidden=forbidden)],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+
+    took, *loaded = out.strip().splitlines()[-1].split()
+    return float(took), loaded
+
+
+def main() -> None:
+    failed = False
+    for statement, (budget, forbidden) in CASES.items():
+        times = []
+        loaded = []
+        for _ in range(REPEATS):
+            took, loaded = run(statement, forbidden)
+            times.append(took)
+
+        took = median(times)
+        ok = took <= budget and not loaded
+        failed |= not ok
+
+        print(
+            f"{'ok' if ok else 'FAIL': <4} {took * 1e3: >8.1f} ms"
+            f" (budget {budget * 1e3:.0f} ms) {statement}"
+        )
+        if loaded:
+            print(f"     loaded eagerly: {', '.join(loaded)}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
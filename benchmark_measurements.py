@@ -0,0 +1,98 @@
+"""
+benchmark_measurements.py
+20. December 2024
+
+Compares allocations and memory of the pydantic message path with the
+internal measurement records
+
+Author:
+Nilusink
+"""
+from time import perf_counter
+import tracemalloc
+import typing as tp
+
+import numpy as np
+
+from core.tools import TResData, Vec3
+from core.maths import CameraResult, Measurement, TrackState
+
+
+N_MEASUREMENTS: int = 10_000
+N_CAMS: int = 3
+
+
+def raw_result(i: int) -> dict:
+    return {
+        "track_id": i,
+        "cam_angles": [
+            {"cam_id": c, "direction": [.01 * c, .02 * c]} for c in range(N_CAMS)
+        ]
+    }
+
+
+def message_path(raw: dict) -> list:
+    """
+    what the tracker allocated per measurement before
+    """
+    result = TResData.model_validate(raw)
+    return [result, [
+        CameraResult(
+            Vec3.from_cartesian(0, 0, 0),
+            Vec3.from_polar(ca.direction[0], ca.direction[1], 100)
+        ) for ca in result.cam_angles
+    ]]
+
+
+def record_path(raw: dict) -> Measurement:
+    """
+    what the tracker allocates per measurement now (conversion at the edge)
+    """
+    return Measurement.from_message(TResData.model_validate(raw), 0.)
+
+
+def measure(name: str, path: tp.Callable[[dict], tp.Any]) -> None:
+    raws = [raw_result(i) for i in range(N_MEASUREMENTS)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = perf_counter()
+
+    kept = [path(raw) for raw in raws]
+
+    took = perf_counter() - start
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+
+    print(
+        f"{name: <14} {took / N_MEASUREMENTS * 1e6: >8.2f} µs/measurement"
+        f" {blocks / N_MEASUREMENTS: >8.1f} blocks/measurement"
+        f" {size / N_MEASUREMENTS: >8.0f} B/measurement"
+    )
+    del kept
+
+
+def main() -> None:
+    print(f"{N_MEASUREMENTS} measurements with {N_CAMS} cameras each")
+    measure("messages", message_path)
+    measure("records", record_path)
+
+    # output side: one state per solved measurement
+    state = TrackState(
+        0, 1, np.zeros(3), .1, 0., 0.,
+        np.arange(N_CAMS), np.zeros((N_CAMS, 3)), np.ones((N_CAMS, 3))
+    )
+    start = perf_counter()
+    for _ in range(N_MEASUREMENTS):
+        state.to_message()
+
+    took = perf_counter() - start
+    print(f"TrackState.to_message: {took / N_MEASUREMENTS * 1e6:.2f} µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,74 @@
-from .tools import *
-from .maths import *
-from .comms import *
-from .tracking import *
+"""
+the subpackages are only imported once one of their names is used,
+everything not listed here is looked up in `tools`
+"""
+import importlib
+import typing as tp
+
+
+_SUBPACKAGES: tuple[str, ...] = (
+    "tools", "diagnostics", "maths", "history", "comms", "pipeline", "tracking",
+)
+
+_EXPORTS: dict[str, str] = {
+    **dict.fromkeys((
+        "metrics", "Metrics", "Counter", "Gauge", "Histogram",
+        "MetricsServer", "tracer", "Tracer", "TraceLevel", "profiler",
+        "Profiler",
+    ), "diagnostics"),
+    **dict.fromkeys((
+        "CameraResult", "Measurement", "CameraRecord", "TrackState",
+        "polar_to_cartesian", "solve", "solve_rays", "AccuracyVolume",
+        "SolveCache", "Backend", "select_backend", "get_backend",
+        "register_backend", "available_backends",
+    ), "maths"),
+    **dict.fromkeys((
+        "HistoryStore", "HistorySamples", "HistoryWriter", "load_history",
+        "TrajectorySimplifier", "simplify",
+    ), "history"),
+    **dict.fromkeys((
+        "DataClient", "DataClientGroup", "CAM_ID_STRIDE", "DataServer",
+        "TResBatchData", "SnapshotData", "TRes3PredData", "HistoryQuery",
+        "HistoryData", "SubscriptionQuery", "ResumeQuery", "PUSH_ID",
+        "MAX_HISTORY_ROWS", "decode_push", "make_push", "split_request",
+        "PendingReplies", "TIMEOUT_ID", "CANCELLED_ID", "reply_status",
+        "SubscriptionIndex",
+    ), "comms"),
+    **dict.fromkeys((
+        "ComputeStage", "OverloadPolicy",
+    ), "pipeline"),
+    **dict.fromkeys((
+        "TrackingMaster", "Track", "ShardedTrackingMaster",
+        "CameraRegistry", "FrameAssembler", "WorldState", "WorldPublisher",
+        "TrackArrays",
+    ), "tracking"),
+}
+
+
+def __getattr__(name: str) -> tp.Any:
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    if name in _SUBPACKAGES:
+        return importlib.import_module(f".{name}", __name__)
+
+    module = importlib.import_module(f".{_EXPORTS.get(name, 'tools')}", __name__)
+
+    try:
+        value = getattr(module, name)
+
+    except AttributeError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
+
+    # only look it up once
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *_SUBPACKAGES, *_EXPORTS})
+
+
+__all__ = list(_EXPORTS)
@@ -1,2 +1,8 @@
 from ._data_client import DataClient
+from ._data_client_group import DataClientGroup, CAM_ID_STRIDE
 from ._data_server import DataServer
+from ._messages import TResBatchData, SnapshotData, TRes3PredData, HistoryQuery, HistoryData
+from ._messages import SubscriptionQuery, ResumeQuery
+from ._messages import PUSH_ID, MAX_HISTORY_ROWS, decode_push, make_push, split_request
+from ._pending_replies import PendingReplies, TIMEOUT_ID, CANCELLED_ID, reply_status
+from ._subscriptions import SubscriptionIndex
@@ -7,45 +7,124 @@ retrieves data from camera tracking
 Author:
 Nilusink
 """
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from contextlib import suppress
 import typing as tp
 import socket as s
+import threading
+import random
+import zlib
 
-from ..tools import debugger, run_with_debug, SimpleLock
+from pydantic import ValidationError
+import numpy as np
+
+from ..tools import debugger, run_with_debug
+from ..diagnostics import metrics, tracer, profiler
 from ..tools.comms import *
+from ._pending_replies import PendingReplies
+from ._messages import PUSH_ID, TResBatchData, ResumeQuery, decode_push
+from ..maths import Measurement
+
+
+_RECEIVE_TIME = metrics.histogram("dataclient_receive_seconds")
+_HANDLE_TIME = metrics.histogram("dataclient_handle_seconds")
+_RECEIVED = metrics.counter("dataclient_messages_total")
+_RECONNECTS = metrics.counter("dataclient_reconnects_total")
+_RECONNECT_TIME = metrics.histogram("dataclient_reconnect_seconds")
+_INVALID_CAM_IDS = metrics.counter("dataclient_invalid_cam_ids_total")
 
 
 class DataClient(s.socket):
+    """
+    receives track results and station information from the camera server
+
+    callbacks are run on the receive thread in the order the messages
+    arrived, so they should only hand the data to a worker stage. Track
+    results are converted to `Measurement`s (with global camera ids and
+    their capture time). Batched frames go to the batch callback if one
+    is given, otherwise each measurement is passed to the track result
+    callback.
+
+    a lost connection is reopened with exponential backoff (starting at
+    `reconnect_delay`), the server is then asked to resume after the
+    last received message. Everything downstream (stations, tracks)
+    is kept.
+
+    with `cam_id_limit`, stations and results with camera ids outside of
+    [0, cam_id_limit) are rejected, they would collide with the ids of
+    other servers once offset.
+    """
     encoding: str = "utf-8"
-    _pending_replies: dict[int, MessageFuture]
+    _pending_replies: PendingReplies
 
     def __init__(
             self,
             server_address: tuple[str, int],
-            on_receive_tres_callback: tp.Callable[[TResData], None],
+            on_receive_tres_callback: tp.Callable[[Measurement], None],
             on_receive_sinf_callback: tp.Callable[[SInfData], None],
             pool: ThreadPoolExecutor,
+            cam_id_offset: int = 0,
+            on_receive_tres_batch_callback: tp.Callable[
+                [list[Measurement]], None
+            ] | None = None,
+            cam_id_limit: int | None = None,
+            auto_reconnect: bool = True,
+            reconnect_delay: float = .05,
+            max_reconnect_delay: float = 2.
     ) -> None:
         self._server_address = server_address
         self._tres_callback = on_receive_tres_callback
         self._sinf_callback = on_receive_sinf_callback
+        self._tres_batch_callback = on_receive_tres_batch_callback
         self._pool = pool
 
+        # added to every camera id, makes ids unique over several servers
+        self._cam_id_offset = cam_id_offset
+        self._cam_id_limit = cam_id_limit
+
         # initialize socket
         super().__init__(s.AF_INET, s.SOCK_STREAM)
         self.settimeout(.2)
 
         # threading stuff
-        self._receive_future: Future = ...
+        self._receive_thread: threading.Thread | None = None
         self._running = False
 
-        self._pending_replies = {}
-        self._pending_replies_sem = SimpleLock()
+        self._pending_replies = PendingReplies("dataclient")
+
+        self._auto_reconnect = auto_reconnect
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+
+        # what has been received so far, for resuming after a reconnect
+        self._last_seq: int | None = None
+        self._stations: dict[int, SInfData] = {}
+        self._stations_version = 0
+
+    @property
+    def server_address(self) -> tuple[str, int]:
+        return self._server_address
 
     def start(self) -> None:
         """
         connects to the server and starts background threads
         """
+        self.open_connection()
+
+        # start thread
+        self._receive_thread = threading.Thread(
+            target=self._receive_loop,
+            name=f"dataclient-{self._server_address[0]}:{self._server_address[1]}",
+            daemon=True
+        )
+        self._receive_thread.start()
+
+    def open_connection(self) -> None:
+        """
+        connects to the server without starting a receive thread, messages
+        then have to be pulled with `receive_once` (see `DataClientGroup`)
+        """
         # connect to server
         try:
             self.connect(self._server_address)
@@ -54,35 +133,103 @@ class DataClient(s.socket):
             debugger.error("DataClient timed out trying to connect to server")
             raise
 
-        debugger.info("DataClient connected to server")
-
-        # start thread
+        debugger.info(f"DataClient connected to server {self._server_address}")
         self._running = True
-        self._receive_future = self._pool.submit(self._receive_loop)
 
     @run_with_debug(show_finish=True, reraise_errors=True)
+    @profiler.role("receive loop")
     def _receive_loop(self) -> None:
         """
         not meant to be called, should be run in a thread
         """
         while self._running:
-            # receive message
-            try:
-                message = receive_message(self, self.send_message, self.encoding)
+            if not self.receive_once():
+                if not self._auto_reconnect or not self.reconnect():
+                    return self.stop()
+
+    def receive_once(self) -> bool:
+        """
+        receive and handle one message, returns False if the connection
+        is no longer usable
+        """
+        # receive message
+        start = perf_counter()
+        try:
+            message = receive_message(self, self.send_message, self.encoding)
+
+            if message is ...:
+                return True
 
-                if message is ...:
-                    continue
+        except RuntimeError:
+            tracer.emit(f"DataClient {self._server_address} receive error")
+            return False
 
-            except RuntimeError:
-                return self.stop()
+        received = perf_counter()
+        _RECEIVE_TIME.observe(received - start)
+        _RECEIVED.inc()
 
-            self._handle_message(message)
+        self._handle_message(message)
+        _HANDLE_TIME.observe(perf_counter() - received)
+        return True
+
+    def reconnect(self) -> bool:
+        """
+        replace the lost connection, retries until connected or stopped.
+        Returns False if the client was stopped.
+        """
+        start = perf_counter()
+        delay = self._reconnect_delay
+
+        while self._running:
+            with suppress(OSError):
+                self.close()
+
+            # reuse this object, it is registered with callbacks and selectors
+            s.socket.__init__(self, s.AF_INET, s.SOCK_STREAM)
+            self.settimeout(.2)
+
+            # replies to messages of the old connection won't arrive
+            self._pending_replies.cancel(None)
+
+            # a connection that drops before the resume request is sent
+            # counts as a failed attempt
+            try:
+                self.connect(self._server_address)
+                self.send_message(self._resume_request())
+
+            except OSError as e:
+                debugger.warning(
+                    f"DataClient reconnect to {self._server_address} failed: {e}"
+                )
+                sleep(delay * random.uniform(.5, 1.))
+                delay = min(delay * 2, self._max_reconnect_delay)
+                continue
+
+            _RECONNECTS.inc()
+            _RECONNECT_TIME.observe(perf_counter() - start)
+            debugger.info(f"DataClient reconnected to {self._server_address}")
+            return True
+
+        return False
+
+    def _resume_request(self) -> ReqData:
+        checksum = zlib.crc32(b"".join(
+            self._stations[cam_id].model_dump_json().encode(self.encoding)
+            for cam_id in sorted(self._stations)
+        ))
+
+        return ReqData(req="resume " + ResumeQuery(
+            last_seq=self._last_seq,
+            cams_version=self._stations_version,
+            cams_checksum=checksum
+        ).model_dump_json())
 
     def _handle_message(self, message: Message) -> None:
         """
         handle a verified message
         """
-        debugger.log(f"handling: {message}")
+        if __debug__:
+            tracer.log("handling: {}", message)
 
         # create acknowledgements
         ack = AckData(to=message.id, ack=True)
@@ -91,39 +238,72 @@ class DataClient(s.socket):
         # message handling
         match message:
             case ReqMessage(type="req", id=_, time=_, data=_):
-                debugger.trace("Matched a ReqMessage!")
-                debugger.trace(f"Request type: {message.data.req}")
+                if __debug__:
+                    tracer.trace("Matched a ReqMessage!")
+                    tracer.trace("Request type: {}", message.data.req)
                 raise RuntimeWarning("not handled")
 
             case AckMessage(type="ack", id=_, time=_, data=_):
-                debugger.trace("Matched an AckMessage!")
-                debugger.trace(f"Ack to: {message.data.to}, Ack status: {message.data.ack}")
+                if __debug__:
+                    tracer.trace("Matched an AckMessage!")
+                    tracer.trace("Ack to: {}, Ack status: {}", message.data.to, message.data.ack)
 
                 self._try_match_reply(message)
                 return  # don't send acknowledgements to an acknowledgement
 
             case ReplMessage(type="repl", id=_, time=_, data=_):
-                debugger.trace("Matched a ReplMessage!")
-                debugger.trace(f"Reply data: {message.data.data}")
+                if __debug__:
+                    tracer.trace("Matched a ReplMessage!")
+                    tracer.trace("Reply data: {}", message.data.data)
 
-                self._try_match_reply(message)
+                if message.data.to == PUSH_ID:
+                    self._last_seq = message.id
+
+                    if not self._handle_push(message):
+                        return self.send_message(nack)
+
+                else:
+                    self._try_match_reply(message)
 
             case DataMessage(type="data", id=_, time=_, data=_):
-                debugger.trace("Matched a DataMessage!")
-                debugger.trace(f"Data message type: {message.data.type}")
+                if __debug__:
+                    tracer.trace("Matched a DataMessage!")
+                    tracer.trace("Data message type: {}", message.data.type)
+
+                self._last_seq = message.id
 
                 match message.data:
                     case TResDataMessage(type="tres", data=_):
-                        debugger.trace(f"Track result, data: {message.data.data}")
+                        if __debug__:
+                            tracer.trace("Track result, data: {}", message.data.data)
+
+                        measurement = Measurement.from_message(
+                            message.data.data,
+                            float(message.time),
+                            self._cam_id_offset
+                        )
+                        if not self._check_cam_ids(measurement.cam_ids):
+                            return self.send_message(nack)
 
-                        # forward message to callback
-                        self._pool.submit(self._tres_callback, message.data.data)
+                        # forward measurement to callback (expected not to block)
+                        self._tres_callback(measurement)
 
                     case SInfDataMessage(type="sinf", data=_):
-                        debugger.trace(f"station information data: {message.data.data}")
+                        if __debug__:
+                            tracer.trace("station information data: {}", message.data.data)
 
-                        # forward message to callback
-                        self._pool.submit(self._sinf_callback, message.data.data)
+                        station = message.data.data
+                        if not self._check_cam_ids(
+                                np.array([station.id + self._cam_id_offset])
+                        ):
+                            return self.send_message(nack)
+
+                        if self._stations.get(station.id) != station:
+                            self._stations[station.id] = station
+                            self._stations_version += 1
+
+                        # forward message to callback (expected not to block)
+                        self._sinf_callback(self._globalize_sinf(station))
 
                     case _:
                         debugger.warning("unknown data type")
@@ -136,50 +316,106 @@ class DataClient(s.socket):
         # send ack
         self.send_message(ack)
 
+    def _handle_push(self, message: ReplMessage) -> bool:
+        """
+        handle a push message, returns False if the payload is invalid
+        """
+        try:
+            payload = decode_push(message.data.data)
+
+        except ValidationError as e:
+            debugger.warning(f"invalid push payload: {e}")
+            return False
+
+        match payload:
+            case TResBatchData():
+                if __debug__:
+                    tracer.trace("Track result batch, {} tracks", len(payload.track_ids))
+
+                measurements = [
+                    measurement
+                    for measurement in payload.measurements(self._cam_id_offset)
+                    if self._check_cam_ids(measurement.cam_ids)
+                ]
+
+                # forward the whole frame at once if possible
+                if self._tres_batch_callback is not None:
+                    self._tres_batch_callback(measurements)
+
+                else:
+                    for measurement in measurements:
+                        self._tres_callback(measurement)
+
+            case SnapshotData():
+                # only sent to viewers
+                debugger.warning("DataClient: upstream server sent a snapshot")
+
+        return True
+
+    def _check_cam_ids(self, cam_ids: np.ndarray) -> bool:
+        """
+        False (and logged) if any of the (offset) ids is out of range
+        """
+        if self._cam_id_limit is None:
+            return True
+
+        local = cam_ids - self._cam_id_offset
+        if local.size and (local.min() < 0 or local.max() >= self._cam_id_limit):
+            _INVALID_CAM_IDS.inc()
+            debugger.warning(
+                f"DataClient {self._server_address}: camera ids {local.tolist()} "
+                f"outside of [0, {self._cam_id_limit})"
+            )
+            return False
+
+        return True
+
+    def _globalize_sinf(self, cam: SInfData) -> SInfData:
+        """
+        convert the id of a station to a global id
+        """
+        if self._cam_id_offset == 0:
+            return cam
+
+        return cam.model_copy(update={"id": cam.id + self._cam_id_offset})
+
     def send_message(self, data: MessageData) -> MessageFuture | None:
         """
         send a message to the server
         """
 
         def append_to_queue(f: MessageFuture) -> None:
-            # make sure no one else is writing to pending_replies
-            self._pending_replies_sem.acquire()
-            self._pending_replies[f.origin_message.id] = f
-            self._pending_replies_sem.release()
+            self._pending_replies.add(f)
 
         message, future = prepare_message(data, append_to_queue)
 
-        debugger.log(f"DataClient: sending: {message}")
+        if __debug__:
+            tracer.log("DataClient: sending: {}", message)
 
         # send message to server
         self.send(message.model_dump_json(
             exclude_unset=True
         ).encode(self.encoding))
 
-        debugger.trace(f"DataClient: sent message")
+        if __debug__:
+            tracer.trace("DataClient: sent message")
         return future
 
     def _try_match_reply(self, message: AckMessage | ReplMessage) -> None:
         """
         try to match a reply type message to an already sent message
         """
-        debugger.trace(f"matching {message}")
-        debugger.trace(f"pending: {self._pending_replies.keys()}")
+        if __debug__:
+            tracer.trace("matching {}", message)
 
-        if message.data.to in self._pending_replies:
-            # make sure no one else is writing to pending_replies
-            self._pending_replies_sem.acquire()
-
-            # remove reply from pending
-            reply = self._pending_replies[message.data.to]
-            self._pending_replies.pop(message.data.to)
-
-            self._pending_replies_sem.release()
+        reply = self._pending_replies.pop(message.data.to)
 
+        if reply is not None:
             # finish message future
             reply.message = message
 
-            debugger.log(f"matched reply to: {message.data.to}")
+            if __debug__:
+                tracer.log("matched reply to: {}", message.data.to)
             return
 
         debugger.warning("Unable to match reply: ", message)
@@ -191,7 +427,12 @@ class DataClient(s.socket):
         debugger.trace("shutting down DataClient")
 
         self._running = False
-        self.shutdown(0)
+        with suppress(OSError):
+            self.shutdown(0)
+
+        # clients driven by a DataClientGroup have no receive thread
+        thread = self._receive_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
 
-        self._receive_future.cancel()
         debugger.info("DataClient shut down")
@@ -0,0 +1,151 @@
+"""
+_data_client_group.py
+12. December 2024
+
+receives data from several camera servers on one thread
+
+Author:
+Nilusink
+"""
+from concurrent.futures import ThreadPoolExecutor
+import selectors
+import typing as tp
+import threading
+
+from ..tools import debugger, run_with_debug
+from ..tools.comms import SInfData
+from ..maths import Measurement
+from ..diagnostics import metrics, profiler
+from ._data_client import DataClient
+
+
+# camera ids of the n-th server are mapped to n * CAM_ID_STRIDE + id
+CAM_ID_STRIDE: int = 1000
+
+
+class DataClientGroup:
+    """
+    one `DataClient` per upstream camera server, all multiplexed onto a
+    single selector based receive loop
+
+    camera ids are made globally unique by offsetting the ids of every
+    server by its index times `cam_id_stride`, so all servers can feed
+    the same camera registry and tracking pipeline. Ids outside of
+    [0, cam_id_stride) are rejected. Lost servers are reconnected on
+    their own thread, the others keep being received meanwhile.
+    """
+    def __init__(
+            self,
+            server_addresses: tp.Sequence[tuple[str, int]],
+            on_receive_tres_callback: tp.Callable[[Measurement], None],
+            on_receive_sinf_callback: tp.Callable[[SInfData], None],
+            pool: ThreadPoolExecutor,
+            cam_id_stride: int = CAM_ID_STRIDE,
+            on_receive_tres_batch_callback: tp.Callable[
+                [list[Measurement]], None
+            ] | None = None,
+    ) -> None:
+        self._pool = pool
+        self._clients = [
+            DataClient(
+                address,
+                on_receive_tres_callback,
+                on_receive_sinf_callback,
+                pool,
+                cam_id_offset=i * cam_id_stride,
+                cam_id_limit=cam_id_stride,
+                on_receive_tres_batch_callback=on_receive_tres_batch_callback
+            ) for i, address in enumerate(server_addresses)
+        ]
+        self._selector = selectors.DefaultSelector()
+
+        # threading stuff
+        self._receive_thread: threading.Thread | None = None
+        self._running = False
+
+        metrics.gauge(
+            "dataclient_upstreams",
+            lambda: len(self._selector.get_map() or {})
+        )
+
+    @property
+    def clients(self) -> list[DataClient]:
+        return list(self._clients)
+
+    def start(self) -> None:
+        """
+        connect to every server and start the receive loop
+        """
+        for client in self._clients:
+            client.open_connection()
+            self._selector.register(client, selectors.EVENT_READ, client)
+
+        self._running = True
+        self._receive_thread = threading.Thread(
+            target=self._receive_loop,
+            name="dataclient-group",
+            daemon=True
+        )
+        self._receive_thread.start()
+
+        debugger.info(f"DataClientGroup receiving from {len(self._clients)} servers")
+
+    @run_with_debug(show_finish=True, reraise_errors=True)
+    @profiler.role("receive loop")
+    def _receive_loop(self) -> None:
+        """
+        not meant to be called, should be run in a thread
+        """
+        while self._running:
+            for key, _ in self._selector.select(timeout=.2):
+                client: DataClient = key.data
+
+                if not client.receive_once():
+                    debugger.error(f"lost upstream {client.server_address}")
+                    self._selector.unregister(client)
+
+                    # backs off for as long as the server is down
+                    threading.Thread(
+                        target=self._reconnect,
+                        args=(client,),
+                        name=f"reconnect-{client.server_address[0]}:{client.server_address[1]}",
+                        daemon=True
+                    ).start()
+
+    @run_with_debug(show_finish=False, reraise_errors=True)
+    @profiler.role("reconnect")
+    def _reconnect(self, client: DataClient) -> None:
+        """
+        not meant to be called, should be run in a thread
+        """
+        try:
+            if client.reconnect() and self._running:
+                self._selector.register(client, selectors.EVENT_READ, client)
+                return
+
+        except Exception:
+            debugger.error(f"giving up on upstream {client.server_address}")
+            client.stop()
+            raise
+
+        client.stop()
+
+    def stop(self) -> None:
+        """
+        stop all clients
+        """
+        debugger.trace("shutting down DataClientGroup")
+
+        self._running = False
+        if self._receive_thread is not None:
+            self._receive_thread.join()
+
+        for client in self._clients:
+            if client in self._selector.get_map():
+                self._selector.unregister(client)
+
+            # also ends reconnect attempts
+            client.stop()
+
+        self._selector.close()
+        debugger.info("DataClientGroup shut down")
@@ -7,15 +7,27 @@ Provides the Data to the GUI
 Author:
 Nilusink
 """
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, perf_counter
 from contextlib import suppress
+from collections import deque
 from uuid import getnode
-from time import sleep
 import typing as tp
+import threading
 import socket
 
+from pydantic import ValidationError
+
 from ..tools import debugger, run_with_debug, SimpleLock
+from ..diagnostics import metrics, tracer, profiler
+from ..history import HistoryStore
+from ..maths import TrackState
 from ..tools.comms import *
+from ._pending_replies import PendingReplies
+from ._messages import SnapshotData, TRes3PredData, HistoryQuery, HistoryData
+from ._messages import SubscriptionQuery
+from ._subscriptions import SubscriptionIndex
+from ._messages import make_push, split_request
 
 
 if tp.TYPE_CHECKING:
@@ -24,16 +36,40 @@ if tp.TYPE_CHECKING:
 
 DEVICE_MAC: int = getnode()
 
+_ENQUEUE_TIME = metrics.histogram("dataserver_enqueue_seconds")
+_SEND_TIME = metrics.histogram("dataserver_send_seconds")
+_ACK_TIME = metrics.histogram("dataserver_ack_seconds")
+_ACK_TIMEOUTS = metrics.counter("dataserver_ack_timeouts_total")
+_UPDATES_SENT = metrics.counter("dataserver_updates_total")
+_MESSAGES_SENT = metrics.counter("dataserver_messages_total")
+_PREDICTION_HORIZON = metrics.histogram("dataserver_prediction_horizon_seconds")
+_SNAPSHOT_BUILD_TIME = metrics.histogram("dataserver_snapshot_build_seconds")
+_SNAPSHOTS_SENT = metrics.counter("dataserver_snapshots_sent_total")
+
 
 class DataServer(socket.socket):
     encoding: str = "utf-8"
-    _pending_replies: dict[int, MessageFuture]
-    _pending_updates: list[TRes3Data | SInfData]
+    _pending_replies: PendingReplies
+    _pending_updates: list[TrackState | SInfData]
 
-    def __init__(self, address: tuple[str, int], pool: ThreadPoolExecutor) -> None:
+    def __init__(
+            self,
+            address: tuple[str, int],
+            pool: ThreadPoolExecutor,
+            track_timeout: float = 5.,
+            history: HistoryStore | None = None,
+            predict: bool = False,
+            max_horizon: float = .5
+    ) -> None:
         self._clients: list[socket.socket] = []
+        self._joining: deque[socket.socket] = deque()
         self._address = address
         self._pool = pool
+        self._history = history
+
+        # extrapolate track states to the time they are sent
+        self.predict = predict
+        self._max_horizon = max_horizon
 
         self.tm: TrackingMaster = ...
 
@@ -43,15 +79,31 @@ class DataServer(socket.socket):
         self.settimeout(.2)
         self.listen()
 
-        # threading stuff
-        self._receive_future: Future = ...
-        self._update_future: Future = ...
+        # threading stuff, every loop has its own thread, the pool is
+        # left to short tasks
+        self._receive_thread: threading.Thread | None = None
+        self._update_thread: threading.Thread | None = None
         self._running = False
 
         self._pending_updates = []
         self._pending_updates_sem = SimpleLock()
-        self._pending_replies = {}
-        self._pending_replies_sem = SimpleLock()
+        # ack latency is measured per client, from sending to its ack
+        self._pending_replies = PendingReplies("dataserver", latency=_ACK_TIME)
+
+        # state as sent to the clients, for the snapshot of new clients
+        self._cams: dict[int, SInfData] = {}
+        self._tracks: dict[int, tuple[float, TRes3Data]] = {}
+        self._track_timeout = track_timeout
+        self._state_version = 0
+
+        # (state version, message, future, encoded message)
+        self._snapshot: tuple[int, Message, MessageFuture, bytes] | None = None
+
+        # track updates only go to the clients subscribed to them
+        self._subscriptions = SubscriptionIndex()
+
+        metrics.gauge("dataserver_clients", lambda: len(self._clients))
+        metrics.gauge("dataserver_pending_updates", lambda: len(self._pending_updates))
 
     def start(self) -> None:
         """
@@ -59,58 +111,125 @@ class DataServer(socket.socket):
         """
         self._running = True
 
-        self._receive_future = self._pool.submit(self._receive_loop)
-        self._update_future = self._pool.submit(self._client_update_loop)
+        self._receive_thread = threading.Thread(
+            target=self._receive_loop,
+            name="dataserver-accept",
+            daemon=True
+        )
+        self._update_thread = threading.Thread(
+            target=self._client_update_loop,
+            name="dataserver-update",
+            daemon=True
+        )
+        self._receive_thread.start()
+        self._update_thread.start()
 
         debugger.info("DataServer started")
 
     @run_with_debug(show_finish=True, reraise_errors=True)
+    @profiler.role("update loop")
     def _client_update_loop(self) -> None:
         """
         update all clients with track updates
         """
         while self._running:
+            # new clients join between updates, so they neither miss nor
+            # repeat any update sent after their snapshot
+            if self._joining:
+                self._join_clients()
+
+            # updates held back by a subscription's rate limit
+            for client, update, exclude in self._subscriptions.flush(perf_counter()):
+                self._send_update(update, [(client, exclude)])
+
             if len(self._pending_updates) <= 0:
+                self._pending_replies.expire()
                 sleep(.01)
-                debugger.trace(f"waiting on update, clients: {len(self._clients)}")
+                if __debug__:
+                    tracer.trace("waiting on update, clients: {}", len(self._clients))
                 continue
 
-            debugger.log(f"server: updating clients, {self._pending_updates}")
+            if __debug__:
+                tracer.log("server: updating clients, {} updates", len(self._pending_updates))
 
             # get updates from list
-            debugger.trace("waiting for sem")
+            if __debug__:
+                tracer.trace("waiting for sem")
             self._pending_updates_sem.acquire()
 
             updates = self._pending_updates
             self._pending_updates = []
 
             self._pending_updates_sem.release()
-            debugger.trace("got sam")
+            if __debug__:
+                tracer.trace("got sam")
 
             # send all updates to all clients
             for update in updates:
-                debugger.trace(f"update: {update}")
+                if __debug__:
+                    tracer.trace("update: {}", update)
+
+                # convert internal records once for all clients
+                self._state_version += 1
+                if isinstance(update, TrackState):
+                    if self._history is not None:
+                        self._history.add(update)
+
+                    received = update.received
+                    update = self._to_message(update)
+                    self._tracks[update.track_id] = (received, update)
+
+                else:
+                    self._cams[update.id] = update
+
+                # stations go to every client
+                if isinstance(update, TRes3Data):
+                    targets = self._subscriptions.match(update, perf_counter())
 
-                # iterate clients
-                futures = []
-                for client in self._clients:
-                    debugger.trace(f"sending to {client}")
-                    with suppress(Exception):
-                        fut = self.send_message(update, client)
-                        futures.append(fut)
+                else:
+                    targets = [(client, None) for client in self._clients]
 
-                # wait for all clients to reply
-                for future in futures:
-                    debugger.trace(f"waiting for {future.origin_message.id}")
+                self._send_update(update, targets)
 
-                    # wait for client
-                    if not future.wait_until_done(.001, .2):
-                        debugger.warning(f"Timeout while waiting for client ack")
-                        continue
+    def _send_update(
+            self,
+            update: TRes3Data | SInfData,
+            targets: list[tuple[socket.socket, set[str] | None]]
+    ) -> None:
+        """
+        send one update to the targets and wait for their acks
+        """
+        # iterate clients
+        futures = []
+        for client, exclude in targets:
+            if __debug__:
+                tracer.trace("sending to {}", client)
+            with suppress(Exception):
+                start = perf_counter()
+                fut = self.send_message(update, client, exclude)
+                _SEND_TIME.observe(perf_counter() - start)
+                futures.append(fut)
+
+        _MESSAGES_SENT.inc(len(futures))
+
+        _UPDATES_SENT.inc()
+
+        # wait for all clients to reply
+        for future in futures:
+            if __debug__:
+                tracer.trace("waiting for {}", future.origin_message.id)
+
+            # wait for client
+            if not future.wait_until_done(.001, .2):
+                debugger.warning(f"Timeout while waiting for client ack")
+                _ACK_TIMEOUTS.inc()
+                continue
 
-                    debugger.trace(f"got {future.origin_message.id}")
+            if __debug__:
+                tracer.trace("got {}", future.origin_message.id)
 
     @run_with_debug(show_finish=True, reraise_errors=True)
+    @profiler.role("accept loop")
     def _receive_loop(self) -> None:
         """
         not meant to be called, should be run in a thread
@@ -124,15 +243,24 @@ class DataServer(socket.socket):
 
             except (ConnectionResetError, OSError, ConnectionAbortedError):
                 debugger.error("DataServer: fatal network error")
+                tracer.emit("DataServer network error")
                 return self.stop()
 
             except Exception:
                 debugger.error("DataServer: fatal error on receive")
+                tracer.emit("DataServer receive error")
                 self.stop()
                 raise
 
-            self._pool.submit(self._handle_client, cl, addr)
+            # one thread per client, it lives as long as the connection
+            threading.Thread(
+                target=self._handle_client,
+                args=(cl, addr),
+                name=f"dataserver-client-{addr[0]}:{addr[1]}",
+                daemon=True
+            ).start()
 
+    @profiler.role("client handler")
     def _handle_client(
             self,
             client: socket.socket,
@@ -143,20 +271,8 @@ class DataServer(socket.socket):
         """
         debugger.info(f"client {addr} connected")
 
-        def send_sinf() -> None:
-            # send all currently available camera info to client
-            debugger.info(f"sending station information to client")
-            for cam in self.tm.cams:
-                debugger.trace(f"sending {cam} to {client}")
-                fut = self.send_message(cam, client)
-
-                # wait for ack
-                fut.wait_until_done(.01)
-
-            self._clients.append(client)
-
-
-        self._pool.submit(send_sinf)
+        # the update loop sends the snapshot and adds the client
+        self._joining.append(client)
 
         while self._running:
             # receive message
@@ -172,7 +288,14 @@ class DataServer(socket.socket):
 
             # disconnect client on message errors
             except RuntimeError:
-                self._clients.remove(client)
+                with suppress(ValueError):
+                    self._joining.remove(client)
+                with suppress(ValueError):
+                    self._clients.remove(client)
+
+                self._subscriptions.remove(client)
+
+                self._pending_replies.cancel(client)
                 client.shutdown(0)
                 return
 
@@ -180,9 +303,10 @@ class DataServer(socket.socket):
 
     def _handle_message(self, message: Message, client: socket.socket) -> None:
         """
-        handle a verified message (should only be receiving acknowledgements)
+        handle a verified message (acknowledgements and requests)
         """
-        debugger.log(f"handling: {message}")
+        if __debug__:
+            tracer.log("handling: {}", message)
 
         # create acknowledgements
         # ack = AckData(to=message.id, ack=True)
@@ -191,20 +315,20 @@ class DataServer(socket.socket):
         # message handling
         match message:
             case ReqMessage(type="req", id=_, time=_, data=_):
-                debugger.warning("DataServer client requested \"req\"")
-                return self.send_message(nack, client)
+                return self._handle_request(message, client)
 
             case AckMessage(type="ack", id=_, time=_, data=_):
-                debugger.trace("Matched an AckMessage!")
-                debugger.trace(f"Ack to: {message.data.to}, Ack status: {message.data.ack}")
+                if __debug__:
+                    tracer.trace("Matched an AckMessage!")
+                    tracer.trace("Ack to: {}, Ack status: {}", message.data.to, message.data.ack)
 
-                self._try_match_reply(message)
+                self._try_match_reply(message, client)
                 return  # don't send acknowledgements to an acknowledgement
 
             case ReplMessage(type="repl", id=_, time=_, data=_):
                 debugger.warning("DataServer client requested \"repl\"")
 
-                self._try_match_reply(message)
+                self._try_match_reply(message, client)
                 return self.send_message(nack, client)
 
             case DataMessage(type="data", id=_, time=_, data=_):
@@ -215,79 +339,236 @@ class DataServer(socket.socket):
                 debugger.warning("unknown message type")
                 return self.send_message(nack, client)
 
+    def _handle_request(self, message: ReqMessage, client: socket.socket) -> None:
+        """
+        answer a client request, unknown or invalid requests are nacked
+        """
+        nack = AckData(to=message.id, ack=False)
+
+        try:
+            kind, args = split_request(message.data.req)
+
+        except ValueError:
+            debugger.warning(f"DataServer: malformed request {message.data.req!r}")
+            return self.send_message(nack, client)
+
+        match kind:
+            case "hist" if self._history is not None:
+                try:
+                    query = HistoryQuery.model_validate(args)
+
+                except ValidationError as e:
+                    debugger.warning(f"DataServer: invalid history query: {e}")
+                    return self.send_message(nack, client)
+
+                reply = self._query_history(query)
+
+            case "state":
+                # the tracker's current state, not synchronized with the updates
+                world = self.tm.world
+                reply = SnapshotData(
+                    version=world.version,
+                    cams=[record.info for record in world.cams.values()],
+                    tracks=[state.to_message() for state in world.tracks()]
+                )
+
+            case "sub":
+                try:
+                    query = SubscriptionQuery.model_validate(args)
+
+                except ValidationError as e:
+                    debugger.warning(f"DataServer: invalid subscription: {e}")
+                    return self.send_message(nack, client)
+
+                debugger.info(f"DataServer: client subscribed with {query}")
+                self._subscriptions.subscribe(client, query)
+                return self.send_message(AckData(to=message.id, ack=True), client)
+
+            case _:
+                debugger.warning(f"DataServer client requested \"{kind}\"")
+                return self.send_message(nack, client)
+
+        self.send_message(ReplData(to=message.id, data=reply.model_dump()), client)
+
+    def _query_history(self, query: HistoryQuery) -> HistoryData:
+        t1 = float("inf") if query.t1 is None else query.t1
+
+        if query.last is not None:
+            t0 = self._history.latest - query.last
+
+        else:
+            t0 = float("-inf") if query.t0 is None else query.t0
+
+        if query.track_id is not None:
+            samples = self._history.track(query.track_id, t0, t1)
+
+        else:
+            samples = self._history.bbox(*query.bbox, t0, t1)
+
+        if query.tolerance is not None:
+            samples = samples.simplified(query.tolerance)
+
+        return HistoryData.from_samples(samples, query.limit)
+
     # @run_with_debug(show_finish=True, reraise_errors=True)
     def send_message(
             self,
             data: MessageData,
-            client: socket.socket
+            client: socket.socket,
+            exclude: set[str] | None = None
     ) -> MessageFuture | None:
         """
-        send a message to the client
+        send a message to the client, `exclude` are fields of a track
+        update not to send
         """
-        debugger.trace(f"DataServer: sending {data}")
+        if __debug__:
+            tracer.trace("DataServer: sending {}", data)
 
         def append_to_queue(f: MessageFuture) -> None:
-            # make sure no one else is writing to pending_replies
-            self._pending_replies_sem.acquire()
-            self._pending_replies[f.origin_message.id] = f
-            self._pending_replies_sem.release()
+            self._pending_replies.add(f, client)
 
         message, future = prepare_message(data, append_to_queue)
 
-        debugger.log(f"DataServer: sending: {message}")
+        if __debug__:
+            tracer.log("DataServer: sending: {}", message)
 
-        # send message to server
-        client.send(message.model_dump_json(
-            exclude_unset=False
+        # send message to server (including fields of local subclasses),
+        # large replies don't fit into one send
+        client.sendall(message.model_dump_json(
+            exclude_unset=False,
+            serialize_as_any=True,
+            exclude=None if exclude is None else {"data": {"data": exclude}}
         ).encode(self.encoding))
 
-        debugger.trace(f"DataServer: sent message")
+        if __debug__:
+            tracer.trace("DataServer: sent message")
         return future
 
-    def update_clients(self, update: TRes3Data | SInfData) -> None:
+    def _to_message(self, state: TrackState) -> TRes3Data:
+        """
+        convert a state, predicted to now if enabled and possible
+        """
+        if not self.predict or state.velocity is None:
+            return state.to_message()
+
+        # time the state spent in the pipeline since it was received
+        horizon = min(perf_counter() - state.received, self._max_horizon)
+        _PREDICTION_HORIZON.observe(horizon)
+
+        return TRes3PredData.from_state(state, horizon)
+
+    def _join_clients(self) -> None:
+        """
+        send the current snapshot to every new client and add them to
+        the updated clients
+        """
+        _, _, future, encoded = self._get_snapshot()
+        while self._joining:
+            client = self._joining.popleft()
+            debugger.info(f"sending snapshot to {client}")
+
+            # all clients get the same message, acks are matched per client
+            self._pending_replies.add(future, client)
+            try:
+                client.sendall(encoded)
+
+            except OSError:
+                debugger.warning("DataServer: unable to send snapshot")
+                self._pending_replies.cancel(client)
+                continue
+
+            _SNAPSHOTS_SENT.inc()
+            self._clients.append(client)
+
+            # until it subscribes, a client gets every update
+            self._subscriptions.subscribe(client)
+
+    def _get_snapshot(self) -> tuple[int, Message, MessageFuture, bytes]:
+        """
+        the snapshot of the current state, built once per state version
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == self._state_version:
+            return snapshot
+
+        start = perf_counter()
+
+        # forget tracks that stopped reporting
+        oldest = perf_counter() - self._track_timeout
+        self._tracks = {
+            track_id: entry for track_id, entry in self._tracks.items()
+            if entry[0] >= oldest
+        }
+
+        message, future = prepare_message(make_push(SnapshotData(
+            version=self._state_version,
+            cams=list(self._cams.values()),
+            tracks=[track for _, track in self._tracks.values()]
+        )), lambda _: None)
+
+        snapshot = self._snapshot = (
+            self._state_version,
+            message,
+            future,
+            message.model_dump_json(
+                exclude_unset=False,
+                serialize_as_any=True
+            ).encode(self.encoding)
+        )
+
+        _SNAPSHOT_BUILD_TIME.observe(perf_counter() - start)
+        return snapshot
+
+    def update_clients(self, update: TrackState | SInfData) -> None:
         """
         send update to clients
         """
-        debugger.trace(f"adding update")
+        if __debug__:
+            tracer.trace("adding update")
+        start = perf_counter()
+
         # check for write permissions
         self._pending_updates_sem.acquire()
         self._pending_updates.append(update)
         self._pending_updates_sem.release()
 
-    def _try_match_reply(self, message: AckMessage | ReplMessage) -> None:
+        _ENQUEUE_TIME.observe(perf_counter() - start)
+
+    def _try_match_reply(
+            self,
+            message: AckMessage | ReplMessage,
+            client: socket.socket
+    ) -> None:
         """
         try to match a reply type message to an already sent message
         """
-        debugger.trace(f"matching {message}")
-        debugger.trace(f"pending: {self._pending_replies.keys()}")
-
-        if message.data.to in self._pending_replies:
-            # make sure no one else is writing to pending_replies
-            self._pending_replies_sem.acquire()
-
-            # remove reply from pending
-            reply = self._pending_replies[message.data.to]
-            self._pending_replies.pop(message.data.to)
+        if __debug__:
+            tracer.trace("matching {}", message)
 
-            self._pending_replies_sem.release()
+        reply = self._pending_replies.pop(message.data.to, client)
 
+        if reply is not None:
             # finish message future
             reply.message = message
 
-            debugger.log(f"matched reply to: {message.data.to}")
+            if __debug__:
+                tracer.log("matched reply to: {}", message.data.to)
             return
 
         debugger.warning("Unable to match reply: ", message)
 
     def stop(self) -> None:
         """
-        stop the client
+        stop the client, returns once the loops have ended (the history
+        is no longer added to)
         """
         debugger.trace("shutting down DataServer")
 
         self._running = False
 
-        self._receive_future.cancel()
-        self._update_future.cancel()
+        # the accept loop stops the server itself on network errors
+        for thread in (self._receive_thread, self._update_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
 
         debugger.info("DataServer shut down")
@@ -0,0 +1,280 @@
+"""
+_messages.py
+18. December 2024
+
+message payloads that extend the tools protocol
+
+the envelope types (`Message`, `ReplData`, ...) are defined by the tools
+submodule. Payloads added here travel inside a `ReplMessage` whose
+`to` is `PUSH_ID`, with the payload in `data` tagged by its `type`.
+Requests are `ReqMessage`s with `req` set to `kind {json arguments}`,
+answered by a `ReplMessage` to the request's id.
+
+Author:
+Nilusink
+"""
+from functools import cache
+import typing as tp
+import json
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, model_validator
+from pydantic import field_validator
+import numpy as np
+
+from ..tools.comms import TResData, ReplData, SInfData, TRes3Data
+from ..history import HistorySamples
+from ..maths import Measurement, TrackState
+
+
+# `ReplData.to` of unsolicited payloads (no message has a negative id)
+PUSH_ID: int = -1
+
+# validators and serializers are built on first use instead of on import
+_LAZY = ConfigDict(defer_build=True)
+
+# most samples sent in one history reply
+MAX_HISTORY_ROWS: int = 10_000
+
+
+class TResBatchData(BaseModel):
+    """
+    all track results of one camera frame as packed arrays
+
+    track `i` owns `cam_counts[i]` consecutive entries of `cam_ids` and
+    `cam_counts[i]` consecutive angle pairs of `directions`
+    """
+    model_config = _LAZY
+
+    type: tp.Literal["tresb"] = "tresb"
+    time: float
+    track_ids: list[int]
+    cam_counts: list[tp.Annotated[int, Field(ge=0)]]
+    cam_ids: list[int]
+    directions: list[float]  # flattened (angle xy, angle xz) pairs
+
+    @model_validator(mode="after")
+    def _check_lengths(self) -> "TResBatchData":
+        if len(self.track_ids) != len(self.cam_counts):
+            raise ValueError("track_ids and cam_counts differ in length")
+
+        if sum(self.cam_counts) != len(self.cam_ids):
+            raise ValueError("cam_counts don't match the number of cam_ids")
+
+        if len(self.directions) != 2 * len(self.cam_ids):
+            raise ValueError("directions must hold two angles per cam id")
+
+        return self
+
+    @classmethod
+    def from_results(cls, results: tp.Sequence[TResData], time: float) -> "TResBatchData":
+        """
+        pack several track results into one batch
+        """
+        return cls(
+            time=time,
+            track_ids=[r.track_id for r in results],
+            cam_counts=[len(r.cam_angles) for r in results],
+            cam_ids=[ca.cam_id for r in results for ca in r.cam_angles],
+            directions=[a for r in results for ca in r.cam_angles for a in ca.direction],
+        )
+
+    def measurements(self, cam_id_offset: int = 0) -> list[Measurement]:
+        """
+        unpack into one measurement per track, the packed arrays are
+        converted once and then only sliced
+        """
+        cam_ids = np.array(self.cam_ids, dtype=np.int64) + cam_id_offset
+        angles = np.array(self.directions, dtype=np.float64).reshape(-1, 2)
+        bounds = np.cumsum([0, *self.cam_counts]).tolist()
+
+        return [
+            Measurement(
+                track_id,
+                self.time,
+                cam_ids[bounds[i]:bounds[i + 1]],
+                angles[bounds[i]:bounds[i + 1]]
+            ) for i, track_id in enumerate(self.track_ids)
+        ]
+
+
+class SnapshotData(BaseModel):
+    """
+    every known station and the latest state of every live track, sent
+    to viewers when they connect
+    """
+    model_config = _LAZY
+
+    type: tp.Literal["snap"] = "snap"
+    version: int
+    cams: list[SInfData]
+    tracks: list[TRes3Data]
+
+
+class TRes3PredData(TRes3Data):
+    """
+    a track result extrapolated from its capture time by `horizon`
+    seconds, `uncertainty` is the expected position error
+    """
+    model_config = _LAZY
+
+    horizon: float
+    uncertainty: float
+    velocity: tuple[float, float, float]
+
+    @classmethod
+    def from_state(cls, state: TrackState, horizon: float) -> "TRes3PredData":
+        base = state.to_message()
+        position = state.position + state.velocity * horizon
+
+        # the fields of `base` are already validated
+        return cls.model_construct(**{
+            **dict(base),
+            "position": tuple(position.tolist()),
+            "horizon": horizon,
+            "uncertainty": float(state.accuracy) + state.velocity_error * horizon,
+            "velocity": tuple(state.velocity.tolist()),
+        })
+
+
+class HistoryQuery(BaseModel):
+    """
+    arguments of a "hist" request, either a track or a bounding box.
+    The time range is [t0, t1] or the last `last` seconds. At most
+    `limit` samples are sent per reply, the rest is requested again
+    with `t0` set to the reply's `next_t0`.
+    """
+    model_config = _LAZY
+
+    track_id: int | None = None
+    bbox: tuple[tuple[float, float, float], tuple[float, float, float]] | None = None
+    t0: float | None = None
+    t1: float | None = None
+    last: float | None = None
+
+    # maximum position error of a simplified reply
+    tolerance: float | None = None
+
+    limit: int = Field(default=MAX_HISTORY_ROWS, gt=0, le=MAX_HISTORY_ROWS)
+
+    @model_validator(mode="after")
+    def _check_target(self) -> "HistoryQuery":
+        if (self.track_id is None) == (self.bbox is None):
+            raise ValueError("expected either track_id or bbox")
+
+        return self
+
+
+class HistoryData(BaseModel):
+    """
+    reply to a "hist" request, the samples as columns. `next_t0` is set
+    if samples were left out because of the query's limit.
+    """
+    model_config = _LAZY
+
+    type: tp.Literal["hist"] = "hist"
+    time: list[float]
+    track_ids: list[int]
+    positions: list[float]  # flattened (x, y, z)
+    accuracy: list[float]
+    next_t0: float | None = None
+
+    @classmethod
+    def from_samples(cls, samples: HistorySamples, limit: int | None = None) -> "HistoryData":
+        """
+        the first `limit` samples, a page never ends between samples of
+        the same time (unless they alone exceed the limit)
+        """
+        next_t0 = None
+        if limit is not None and len(samples) > limit:
+            next_t0 = float(samples.time[limit])
+
+            end = int(np.searchsorted(samples.time, next_t0, side="left"))
+            if end == 0:
+                end = int(np.searchsorted(samples.time, next_t0, side="right"))
+                next_t0 = float(samples.time[end]) if end < len(samples) else None
+
+            samples = HistorySamples(
+                samples.time[:end],
+                samples.track_ids[:end],
+                samples.positions[:end],
+                samples.accuracy[:end]
+            )
+
+        return cls(
+            time=samples.time.tolist(),
+            track_ids=samples.track_ids.tolist(),
+            positions=samples.positions.ravel().tolist(),
+            accuracy=samples.accuracy.tolist(),
+            next_t0=next_t0,
+        )
+
+
+class SubscriptionQuery(BaseModel):
+    """
+    arguments of a "sub" request, all filters are optional. `max_rate`
+    is in updates per second and track, `fields` are the fields of the
+    track updates to send (`TRes3Data` or, with prediction, `TRes3PredData`).
+    """
+    model_config = _LAZY
+
+    max_rate: float | None = Field(default=None, gt=0)
+    bbox: tuple[tuple[float, float, float], tuple[float, float, float]] | None = None
+    track_ids: list[int] | None = None
+    fields: list[str] | None = None
+
+    @field_validator("fields")
+    @classmethod
+    def _check_fields(cls, fields: list[str] | None) -> list[str] | None:
+        if fields is not None:
+            unknown = set(fields) - set(TRes3PredData.model_fields)
+            if unknown:
+                raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+
+        return fields
+
+
+class ResumeQuery(BaseModel):
+    """
+    arguments of a "resume" request, sent by a reconnecting client so the
+    server only has to send what it missed. `last_seq` is the id of the
+    last message received, the stations are identified by the number of
+    changes seen and a checksum of their current state.
+    """
+    model_config = _LAZY
+
+    last_seq: int | None
+    cams_version: int
+    cams_checksum: int
+
+
+def split_request(req: str) -> tuple[str, dict]:
+    """
+    split a request string of the form `kind {json arguments}`
+    """
+    kind, _, args = req.partition(" ")
+    return kind, json.loads(args) if args.strip() else {}
+
+
+PushData = tp.Annotated[
+    tp.Union[TResBatchData, SnapshotData],
+    Field(discriminator="type")
+]
+
+
+@cache
+def _push_adapter() -> TypeAdapter:
+    return TypeAdapter(PushData)
+
+
+def decode_push(data: dict) -> PushData:
+    """
+    validate the payload of a push message
+    """
+    return _push_adapter().validate_python(data)
+
+
+def make_push(payload: BaseModel) -> ReplData:
+    """
+    wrap a payload for sending as a push message
+    """
+    return ReplData(to=PUSH_ID, data=payload.model_dump())
@@ -0,0 +1,194 @@
+"""
+_pending_replies.py
+07. January 2025
+
+sent messages waiting for a reply, with deadlines
+
+Author:
+Nilusink
+"""
+from time import perf_counter, time
+import typing as tp
+import threading
+import heapq
+
+from ..tools.comms import MessageFuture, AckMessage, AckData
+from ..diagnostics import metrics, Histogram
+
+
+# ids of the nacks that complete futures without a reply, real messages
+# never have negative ids
+TIMEOUT_ID: int = -2
+CANCELLED_ID: int = -3
+
+
+def _complete(future: MessageFuture, message_id: int, status_id: int) -> None:
+    future.message = AckMessage(
+        type="ack",
+        id=status_id,
+        time=time(),
+        data=AckData(to=message_id, ack=False)
+    )
+
+
+def reply_status(future: MessageFuture) -> str | None:
+    """
+    "timeout" or "cancelled" if the future was completed without a reply,
+    "nack" or "ok" for replies, None while pending
+    """
+    message = future.message
+    if message is None:
+        return None
+
+    if message.id == TIMEOUT_ID:
+        return "timeout"
+
+    if message.id == CANCELLED_ID:
+        return "cancelled"
+
+    if isinstance(message, AckMessage) and not message.data.ack:
+        return "nack"
+
+    return "ok"
+
+
+class _Group:
+    """
+    pending replies of one owner (e.g. one connected client)
+    """
+    __slots__ = ("entries", "cancelled")
+
+    def __init__(self) -> None:
+        # message id: (future, time it was added)
+        self.entries: dict[int, tuple[MessageFuture, float]] = {}
+        self.cancelled = False
+
+
+class PendingReplies:
+    """
+    registry of message futures that are waiting for an ack or reply
+
+    every entry gets a deadline, expired entries are completed with a
+    nack from `TIMEOUT_ID` and removed. Entries are grouped by owner, so
+    all replies of a disconnected client can be dropped at once with
+    `cancel` (completed with a nack from `CANCELLED_ID`). If given,
+    `latency` gets the time from `add` to `pop` of every matched reply.
+    """
+    def __init__(
+            self,
+            name: str,
+            timeout: float = 2.,
+            latency: Histogram | None = None
+    ) -> None:
+        self._timeout = timeout
+        self._latency = latency
+
+        self._groups: dict[tp.Hashable, _Group] = {}
+
+        # (deadline, sequence, group, message id), entries of cancelled
+        # groups or matched replies are skipped when they come up
+        self._deadlines: list[tuple[float, int, _Group, int]] = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+        self._expired = metrics.counter(f"{name}_replies_expired_total")
+        self._cancelled = metrics.counter(f"{name}_replies_cancelled_total")
+        metrics.gauge(f"{name}_replies_pending", lambda: len(self))
+
+    def __len__(self) -> int:
+        return sum(len(group.entries) for group in list(self._groups.values()))
+
+    def add(
+            self,
+            future: MessageFuture,
+            owner: tp.Hashable = None,
+            timeout: float | None = None
+    ) -> None:
+        """
+        register a future for the message it was created for
+        """
+        now = perf_counter()
+        deadline = now + (self._timeout if timeout is None else timeout)
+        message_id = future.origin_message.id
+
+        with self._lock:
+            group = self._groups.get(owner)
+            if group is None:
+                group = self._groups[owner] = _Group()
+
+            group.entries[message_id] = (future, now)
+
+            self._sequence += 1
+            heapq.heappush(
+                self._deadlines,
+                (deadline, self._sequence, group, message_id)
+            )
+
+        # keep the heap short without a separate thread
+        self.expire(now)
+
+    def pop(self, message_id: int, owner: tp.Hashable = None) -> MessageFuture | None:
+        """
+        remove and return the future waiting on `message_id`
+        """
+        with self._lock:
+            group = self._groups.get(owner)
+            if group is None:
+                return None
+
+            entry = group.entries.pop(message_id, None)
+
+        if entry is None:
+            return None
+
+        future, added = entry
+        if self._latency is not None:
+            self._latency.observe(perf_counter() - added)
+
+        return future
+
+    def cancel(self, owner: tp.Hashable) -> int:
+        """
+        drop every entry of `owner`, returns the number of dropped entries.
+        The group is only detached here, its heap entries are discarded
+        once their deadline comes up.
+        """
+        with self._lock:
+            group = self._groups.pop(owner, None)
+
+            if group is None:
+                return 0
+
+            # nothing else touches a cancelled group
+            group.cancelled = True
+
+        # waiting threads are released right away
+        for message_id, (future, _) in group.entries.items():
+            _complete(future, message_id, CANCELLED_ID)
+
+        self._cancelled.inc(len(group.entries))
+        return len(group.entries)
+
+    def expire(self, now: float | None = None) -> int:
+        """
+        complete all entries past their deadline with a timeout nack
+        """
+        now = perf_counter() if now is None else now
+        expired: list[tuple[int, MessageFuture]] = []
+
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, _, group, message_id = heapq.heappop(self._deadlines)
+
+                if group.cancelled:
+                    continue
+
+                entry = group.entries.pop(message_id, None)
+                if entry is not None:
+                    expired.append((message_id, entry[0]))
+
+        for message_id, future in expired:
+            _complete(future, message_id, TIMEOUT_ID)
+
+        self._expired.inc(len(expired))
+        return len(expired)
@@ -0,0 +1,256 @@
+"""
+_subscriptions.py
+15. January 2025
+
+which clients want which track updates
+
+Author:
+Nilusink
+"""
+import threading
+import typing as tp
+import math
+
+from ..tools.comms import TRes3Data
+from ._messages import SubscriptionQuery
+
+
+Cell = tuple[int, int, int]
+
+
+class _Subscription:
+    __slots__ = (
+        "client", "interval", "bbox", "track_ids", "fields", "excludes",
+        "cells", "last_sent", "deferred",
+    )
+
+    def __init__(self, client: tp.Hashable, query: SubscriptionQuery) -> None:
+        self.client = client
+        self.interval = 0. if not query.max_rate else 1 / query.max_rate
+        self.bbox = query.bbox
+        self.track_ids = None if query.track_ids is None else set(query.track_ids)
+
+        # fields to send, the discriminator and the track id are always sent
+        self.fields = None if query.fields is None else {
+            *query.fields, "type", "track_id"
+        }
+
+        # update model: its fields not to send
+        self.excludes: dict[type, set[str]] = {}
+
+        # grid cells the bounding box covers, None if not indexed by cell
+        self.cells: list[Cell] | None = None
+
+        # track id: time of the last update sent, only if rate limited
+        self.last_sent: dict[int, float] = {}
+
+        # track id: newest update held back by the rate limit
+        self.deferred: dict[int, TRes3Data] = {}
+
+    def accepts(self, update: TRes3Data) -> bool:
+        if self.track_ids is not None and update.track_id not in self.track_ids:
+            return False
+
+        if self.bbox is not None:
+            lower, upper = self.bbox
+            return all(lo <= p <= up for lo, p, up in zip(lower, update.position, upper))
+
+        return True
+
+    def exclude(self, update: TRes3Data) -> set[str] | None:
+        """
+        the fields of this update not to send
+        """
+        if self.fields is None:
+            return None
+
+        model = type(update)
+        exclude = self.excludes.get(model)
+        if exclude is None:
+            exclude = self.excludes[model] = set(model.model_fields) - self.fields
+
+        return exclude
+
+
+class SubscriptionIndex:
+    """
+    subscriptions of all clients, indexed by the region and tracks they
+    are interested in
+
+    bounding boxes are registered in every cell of a uniform grid they
+    overlap (boxes covering more than `max_cells` cells are checked for
+    every update), so an update only looks at the subscriptions of its
+    own cell, of its track id and the unfiltered ones. `max_rate` limits
+    the updates per second of every single track, the newest update
+    held back is sent by `flush` once the interval has passed.
+    """
+    def __init__(self, cell_size: float = 50., max_cells: int = 4096) -> None:
+        self._cell_size = cell_size
+        self._max_cells = max_cells
+
+        self._subscriptions: dict[tp.Hashable, _Subscription] = {}
+        self._cells: dict[Cell, set[tp.Hashable]] = {}
+        self._tracks: dict[int, set[tp.Hashable]] = {}
+        self._everywhere: set[tp.Hashable] = set()
+
+        # rate limited subscriptions are checked by `flush` from then on
+        self._next_flush = 0.
+
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, client: tp.Hashable, query: SubscriptionQuery | None = None) -> None:
+        """
+        set the subscription of a client, replacing the previous one
+        (no query subscribes to everything)
+        """
+        subscription = _Subscription(client, query or SubscriptionQuery())
+
+        with self._lock:
+            self._remove(client)
+            self._subscriptions[client] = subscription
+
+            if subscription.bbox is not None:
+                cells = self._cells_of(*subscription.bbox)
+
+                if cells is not None:
+                    subscription.cells = cells
+                    for cell in cells:
+                        self._cells.setdefault(cell, set()).add(client)
+
+                    return
+
+            if subscription.track_ids is not None:
+                for track_id in subscription.track_ids:
+                    self._tracks.setdefault(track_id, set()).add(client)
+
+                return
+
+            self._everywhere.add(client)
+
+    def remove(self, client: tp.Hashable) -> None:
+        with self._lock:
+            self._remove(client)
+
+    def _remove(self, client: tp.Hashable) -> None:
+        subscription = self._subscriptions.pop(client, None)
+        if subscription is None:
+            return
+
+        self._everywhere.discard(client)
+
+        for cell in subscription.cells or ():
+            self._discard(self._cells, cell, client)
+
+        for track_id in subscription.track_ids or ():
+            self._discard(self._tracks, track_id, client)
+
+    @staticmethod
+    def _discard(index: dict, key: tp.Hashable, client: tp.Hashable) -> None:
+        clients = index.get(key)
+        if clients is not None:
+            clients.discard(client)
+
+            if not clients:
+                del index[key]
+
+    def _cell(self, position: tp.Sequence[float]) -> Cell:
+        return tuple(math.floor(p / self._cell_size) for p in position)
+
+    def _cells_of(
+            self,
+            lower: tp.Sequence[float],
+            upper: tp.Sequence[float]
+    ) -> list[Cell] | None:
+        """
+        all grid cells overlapping the box, None if there are too many
+        """
+        lower_cell = self._cell(lower)
+        upper_cell = self._cell(upper)
+
+        counts = [u - l + 1 for l, u in zip(lower_cell, upper_cell)]
+        if math.prod(counts) > self._max_cells:
+            return None
+
+        return [
+            (x, y, z)
+            for x in range(lower_cell[0], upper_cell[0] + 1)
+            for y in range(lower_cell[1], upper_cell[1] + 1)
+            for z in range(lower_cell[2], upper_cell[2] + 1)
+        ]
+
+    def match(
+            self,
+            update: TRes3Data,
+            now: float
+    ) -> list[tuple[tp.Hashable, set[str] | None]]:
+        """
+        the clients to send a track update to, with the fields to exclude
+        """
+        with self._lock:
+            candidates = set(self._everywhere)
+            candidates.update(self._tracks.get(update.track_id, ()))
+            candidates.update(self._cells.get(self._cell(update.position), ()))
+
+            targets = []
+            for client in candidates:
+                subscription = self._subscriptions[client]
+                if not subscription.accepts(update):
+                    continue
+
+                if subscription.interval:
+                    last = subscription.last_sent.get(update.track_id)
+                    if last is not None and now - last < subscription.interval:
+                        subscription.deferred[update.track_id] = update
+                        self._next_flush = min(self._next_flush, last + subscription.interval)
+                        continue
+
+                    subscription.last_sent[update.track_id] = now
+                    subscription.deferred.pop(update.track_id, None)
+
+                targets.append((client, subscription.exclude(update)))
+
+            return targets
+
+    def flush(
+            self,
+            now: float,
+            period: float = 1.
+    ) -> list[tuple[tp.Hashable, TRes3Data, set[str] | None]]:
+        """
+        the held back updates whose interval has passed, with the client
+        to send them to and the fields to exclude. Also forgets the tracks
+        that weren't sent for longer than their interval, at least every
+        `period` seconds.
+        """
+        if now < self._next_flush:
+            return []
+
+        with self._lock:
+            due = []
+            next_flush = now + period
+
+            for subscription in self._subscriptions.values():
+                if not subscription.interval:
+                    continue
+
+                last_sent = subscription.last_sent
+                for track_id, last in list(last_sent.items()):
+                    if now - last < subscription.interval:
+                        if track_id in subscription.deferred:
+                            next_flush = min(next_flush, last + subscription.interval)
+
+                        continue
+
+                    update = subscription.deferred.pop(track_id, None)
+                    if update is None:
+                        del last_sent[track_id]
+                        continue
+
+                    last_sent[track_id] = now
+                    due.append((subscription.client, update, subscription.exclude(update)))
+
+            self._next_flush = next_flush
+            return due
@@ -0,0 +1,4 @@
+from ._metrics import metrics, Metrics, Counter, Gauge, Histogram
+from ._metrics_server import MetricsServer
+from ._trace import tracer, Tracer, TraceLevel
+from ._profiler import profiler, Profiler
@@ -0,0 +1,227 @@
+"""
+_metrics.py
+02. December 2024
+
+low overhead counters and latency histograms
+
+Author:
+Nilusink
+"""
+from contextlib import contextmanager
+from time import perf_counter
+from bisect import bisect_left
+import typing as tp
+import threading
+
+
+# default bucket upper bounds in seconds (10 µs ... 5 s)
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    .00001, .000025, .00005, .0001, .00025, .0005,
+    .001, .0025, .005, .01, .025, .05,
+    .1, .25, .5, 1., 2.5, 5.,
+)
+
+
+class Counter:
+    """
+    monotonic counter
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def inc(self, n: int = 1) -> None:
+        with self._lock:
+            self._value += n
+
+
+class Gauge:
+    """
+    value that can go up and down, either set directly or read from a
+    callback at snapshot time
+    """
+    def __init__(
+            self,
+            name: str,
+            getter: tp.Callable[[], float] | None = None
+    ) -> None:
+        self.name = name
+        self._value = 0.
+        self._getter = getter
+
+    @property
+    def value(self) -> float:
+        if self._getter is not None:
+            return self._getter()
+
+        return self._value
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+
+class Histogram:
+    """
+    fixed bucket histogram, buckets are upper bounds (in seconds)
+    """
+    def __init__(
+            self,
+            name: str,
+            buckets: tp.Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self._buckets = tuple(buckets)
+
+        # last bucket is +Inf
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def buckets(self) -> tuple[float, ...]:
+        return self._buckets
+
+    def observe(self, value: float) -> None:
+        """
+        add one sample
+        """
+        i = bisect_left(self._buckets, value)
+
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> tp.Iterator[None]:
+        """
+        observe the duration of a with-block
+        """
+        start = perf_counter()
+        try:
+            yield
+
+        finally:
+            self.observe(perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            count = self._count
+
+        # cumulative counts per upper bound
+        cumulative = []
+        running = 0
+        for bound, n in zip((*self._buckets, float("inf")), counts):
+            running += n
+            cumulative.append((bound, running))
+
+        return {
+            "count": count,
+            "sum": total,
+            "buckets": cumulative,
+        }
+
+
+class Metrics:
+    """
+    registry of all counters, gauges and histograms
+    """
+    def __init__(self) -> None:
+        self._counters: dict[str, Counter] = {}
+        self._gauges: dict[str, Gauge] = {}
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        """
+        get or create a counter
+        """
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter(name)
+
+            return self._counters[name]
+
+    def gauge(
+            self,
+            name: str,
+            getter: tp.Callable[[], float] | None = None
+    ) -> Gauge:
+        """
+        get or create a gauge, a given getter replaces the previous one
+        """
+        with self._lock:
+            if name not in self._gauges:
+                self._gauges[name] = Gauge(name, getter)
+
+            elif getter is not None:
+                self._gauges[name]._getter = getter
+
+            return self._gauges[name]
+
+    def histogram(
+            self,
+            name: str,
+            buckets: tp.Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """
+        get or create a histogram
+        """
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, buckets)
+
+            return self._histograms[name]
+
+    def snapshot(self) -> dict:
+        """
+        current values of every registered metric
+        """
+        with self._lock:
+            counters = list(self._counters.values())
+            gauges = list(self._gauges.values())
+            histograms = list(self._histograms.values())
+
+        return {
+            "counters": {c.name: c.value for c in counters},
+            "gauges": {g.name: g.value for g in gauges},
+            "histograms": {h.name: h.snapshot() for h in histograms},
+        }
+
+    def render(self) -> str:
+        """
+        plain text exposition of the current snapshot
+        """
+        snap = self.snapshot()
+        lines: list[str] = []
+
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+
+        for name, value in sorted(snap["gauges"].items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+        for name, hist in sorted(snap["histograms"].items()):
+            lines.append(f"# TYPE {name} histogram")
+            for bound, n in hist["buckets"]:
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{{le=\"{le}\"}} {n}")
+
+            lines.append(f"{name}_sum {hist['sum']}")
+            lines.append(f"{name}_count {hist['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+# global registry, used by all pipeline stages
+metrics = Metrics()
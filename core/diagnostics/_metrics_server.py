@@ -0,0 +1,136 @@
+"""
+_metrics_server.py
+02. December 2024
+
+serves the metrics registry as plain text
+
+Author:
+Nilusink
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import socket
+
+from ..tools import debugger, run_with_debug
+from ._metrics import metrics, Metrics
+from ._profiler import profiler, Profiler
+
+
+class MetricsServer(socket.socket):
+    """
+    minimal http endpoint, requests are answered with the current
+    metrics in plain text
+
+    the profiler is controlled by the paths `/profile/start` and
+    `/profile/stop`, stopping replies with the collapsed stacks.
+    """
+    encoding: str = "utf-8"
+
+    def __init__(
+            self,
+            address: tuple[str, int],
+            pool: ThreadPoolExecutor,
+            registry: Metrics = metrics,
+            profiler: Profiler = profiler
+    ) -> None:
+        self._address = address
+        self._pool = pool
+        self._registry = registry
+        self._profiler = profiler
+
+        # initialize socket
+        super().__init__(socket.AF_INET, socket.SOCK_STREAM)
+        self.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.bind(self._address)
+        self.settimeout(.2)
+        self.listen()
+
+        # threading stuff
+        self._receive_thread: threading.Thread | None = None
+        self._running = False
+
+    def start(self) -> None:
+        """
+        start the server
+        """
+        self._running = True
+        self._receive_thread = threading.Thread(
+            target=self._receive_loop,
+            name="metrics-server",
+            daemon=True
+        )
+        self._receive_thread.start()
+
+        debugger.info(f"MetricsServer listening on {self._address}")
+
+    @run_with_debug(show_finish=True, reraise_errors=True)
+    @profiler.role("metrics server")
+    def _receive_loop(self) -> None:
+        """
+        not meant to be called, should be run in a thread
+        """
+        while self._running:
+            try:
+                cl, _ = self.accept()
+
+            except socket.timeout:
+                continue
+
+            except OSError:
+                debugger.error("MetricsServer: fatal network error")
+                return self.stop()
+
+            # requests are tiny, answer them in the accept loop
+            try:
+                self._answer(cl)
+
+            except OSError:
+                debugger.warning("MetricsServer: failed to answer request")
+
+            finally:
+                cl.close()
+
+    def _answer(self, client: socket.socket) -> None:
+        """
+        read the request line and reply with the metrics text
+        """
+        client.settimeout(.2)
+        request = client.recv(1024).decode(self.encoding, errors="replace")
+
+        # "GET /path HTTP/1.0"
+        parts = request.split(" ", 2)
+        path = parts[1] if len(parts) > 1 else "/"
+
+        match path:
+            case "/profile/start":
+                self._profiler.start()
+                body = "profiler started\n"
+
+            case "/profile/stop":
+                self._profiler.stop()
+                body = self._profiler.dump()
+
+            case _:
+                body = self._registry.render()
+
+        body = body.encode(self.encoding)
+        head = (
+            "HTTP/1.0 200 OK\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n"
+        ).encode(self.encoding)
+
+        client.sendall(head + body)
+
+    def stop(self) -> None:
+        """
+        stop the server
+        """
+        self._running = False
+
+        thread = self._receive_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+        debugger.info("MetricsServer shut down")
@@ -0,0 +1,163 @@
+"""
+_profiler.py
+24. January 2025
+
+sampling profiler that can be switched on in a running process
+
+Author:
+Nilusink
+"""
+from contextlib import contextmanager
+from collections import Counter
+import threading
+import typing as tp
+import sys
+import os
+
+from ..tools import debugger
+
+
+class Profiler:
+    """
+    samples the stacks of all threads every `interval` seconds
+
+    threads are grouped by the role they currently have (see `role`),
+    threads without one by their name. The result is written in the
+    collapsed stack format (`role;outer;...;inner count`), which flame
+    graph tools read directly. Nothing is sampled while stopped.
+    """
+    def __init__(self, interval: float = .005, max_depth: int = 64) -> None:
+        self._interval = interval
+        self._max_depth = max_depth
+
+        # thread ident: role
+        self._roles: dict[int, str] = {}
+
+        self._samples: Counter[tuple[str, ...]] = Counter()
+        self._n_samples = 0
+        self._lock = threading.Lock()
+
+        self._thread: threading.Thread | None = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def n_samples(self) -> int:
+        return self._n_samples
+
+    @contextmanager
+    def role(self, name: str) -> tp.Iterator[None]:
+        """
+        mark the current thread (e.g. a pool thread running a loop), can
+        also be used as a decorator
+        """
+        ident = threading.get_ident()
+        previous = self._roles.get(ident)
+        self._roles[ident] = name
+
+        try:
+            yield
+
+        finally:
+            if previous is None:
+                self._roles.pop(ident, None)
+
+            else:
+                self._roles[ident] = previous
+
+    def start(self, interval: float | None = None) -> None:
+        """
+        start sampling, previous samples are discarded
+        """
+        if self.running:
+            return
+
+        if interval is not None:
+            self._interval = interval
+
+        with self._lock:
+            self._samples.clear()
+            self._n_samples = 0
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._sample_loop,
+            name="profiler",
+            daemon=True
+        )
+        self._thread.start()
+
+        debugger.info(f"profiler started, interval {self._interval * 1e3:.1f} ms")
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+        debugger.info(f"profiler stopped after {self._n_samples} samples")
+
+    def toggle(self, path: str | None = None) -> None:
+        """
+        start or stop sampling, the collapsed stacks are written to
+        `path` when stopping
+        """
+        if not self.running:
+            return self.start()
+
+        self.stop()
+        if path is not None:
+            self.write(path)
+
+    def _sample_loop(self) -> None:
+        own = threading.get_ident()
+
+        while not self._stop_event.wait(self._interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                stack = []
+                while frame is not None and len(stack) < self._max_depth:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+
+                role = self._roles.get(ident) or names.get(ident, str(ident))
+                stacks.append((role, *reversed(stack)))
+
+            with self._lock:
+                self._samples.update(stacks)
+                self._n_samples += 1
+
+    def dump(self) -> str:
+        """
+        the samples in collapsed stack format
+        """
+        with self._lock:
+            samples = sorted(self._samples.items())
+
+        return "".join(
+            f"{';'.join(part.replace(';', ',') for part in stack)} {count}\n"
+            for stack, count in samples
+        )
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as out:
+            out.write(self.dump())
+
+        debugger.info(f"profile written to {path}")
+
+
+# process wide profiler
+profiler = Profiler()
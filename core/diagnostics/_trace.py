@@ -0,0 +1,125 @@
+"""
+_trace.py
+04. December 2024
+
+structured hot path tracing into an in-memory ring buffer
+
+Author:
+Nilusink
+"""
+from collections import deque
+from time import perf_counter
+from enum import IntEnum
+import typing as tp
+import threading
+
+from ..tools import debugger
+
+
+class TraceLevel(IntEnum):
+    trace = 0
+    log = 1
+    off = 2
+
+
+# (timestamp, thread ident, level, format string, format args)
+TraceRecord = tuple[float, int, TraceLevel, str, tuple]
+
+
+class Tracer:
+    """
+    records hot path events without formatting them
+
+    call sites should be wrapped in `if __debug__:`, that way the whole
+    statement (including the level check) is removed when running with
+    `python -O`. Arguments are stored by reference and only formatted
+    when the buffer is dumped, so they should not be mutated afterward.
+    """
+    def __init__(
+            self,
+            capacity: int = 4096,
+            level: TraceLevel = TraceLevel.log
+    ) -> None:
+        self._capacity = capacity
+        self._level = level
+
+        # appending to a bounded deque is atomic, no lock required
+        self._ring: deque[TraceRecord] = deque(maxlen=capacity)
+
+    @property
+    def level(self) -> TraceLevel:
+        return self._level
+
+    @level.setter
+    def level(self, value: TraceLevel) -> None:
+        self._level = value
+
+    def trace(self, fmt: str, *args: tp.Any) -> None:
+        """
+        record a trace level event, `fmt` uses `str.format` placeholders
+        """
+        if self._level <= TraceLevel.trace:
+            self._ring.append(
+                (perf_counter(), threading.get_ident(), TraceLevel.trace, fmt, args)
+            )
+
+    def log(self, fmt: str, *args: tp.Any) -> None:
+        """
+        record a log level event, `fmt` uses `str.format` placeholders
+        """
+        if self._level <= TraceLevel.log:
+            self._ring.append(
+                (perf_counter(), threading.get_ident(), TraceLevel.log, fmt, args)
+            )
+
+    def dump(self, clear: bool = True) -> list[str]:
+        """
+        format all buffered records (oldest first)
+        """
+        if clear:
+            # swap buffers, writers only ever append to the current one
+            records = self._ring
+            self._ring = deque(maxlen=self._capacity)
+
+        else:
+            records = self._ring.copy()
+
+        names = {t.ident: t.name for t in threading.enumerate()}
+
+        lines = []
+        for stamp, ident, level, fmt, args in records:
+            try:
+                text = fmt.format(*args)
+
+            except Exception as e:
+                text = f"{fmt} {args!r} (format failed: {e})"
+
+            lines.append(
+                f"{stamp:.6f} {names.get(ident, ident)} {level.name}: {text}"
+            )
+
+        return lines
+
+    def write(self, path: str) -> int:
+        """
+        append all buffered records to a file, returns the number of lines
+        """
+        lines = self.dump()
+
+        with open(path, "a") as out:
+            out.writelines(line + "\n" for line in lines)
+
+        return len(lines)
+
+    def emit(self, reason: str) -> None:
+        """
+        dump the buffer to the debugger, meant for error paths
+        """
+        lines = self.dump()
+        debugger.error(
+            f"trace dump ({reason}), {len(lines)} records:\n" + "\n".join(lines)
+        )
+
+
+# global tracer, used by all hot paths
+tracer = Tracer()
@@ -0,0 +1,3 @@
+from ._history_store import HistoryStore, HistorySamples
+from ._history_writer import HistoryWriter, load_history
+from ._simplify import TrajectorySimplifier, simplify
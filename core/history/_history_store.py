@@ -0,0 +1,364 @@
+"""
+_history_store.py
+09. January 2025
+
+recent track positions in time partitioned column blocks
+
+Author:
+Nilusink
+"""
+from collections import deque
+import typing as tp
+import threading
+
+import numpy as np
+
+from ..diagnostics import metrics
+from ..maths import TrackState
+from ._simplify import TrajectorySimplifier, simplify
+
+
+_QUERY_TIME = metrics.histogram("history_query_seconds")
+_SAMPLES = metrics.counter("history_samples_total")
+_STORED = metrics.counter("history_stored_samples_total")
+_LATE = metrics.counter("history_late_samples_total")
+
+
+class HistorySamples:
+    """
+    columns of a query result, ordered by time
+    """
+    __slots__ = ("time", "track_ids", "positions", "accuracy")
+
+    def __init__(
+            self,
+            time: np.ndarray,
+            track_ids: np.ndarray,
+            positions: np.ndarray,
+            accuracy: np.ndarray
+    ) -> None:
+        self.time = time              # (n,) capture time
+        self.track_ids = track_ids    # (n,)
+        self.positions = positions    # (n, 3)
+        self.accuracy = accuracy      # (n,)
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def simplified(self, tolerance: float) -> "HistorySamples":
+        """
+        drop the samples of every track that are within `tolerance` of
+        the interpolation between their neighbours
+        """
+        rows = [
+            track_rows[simplify(self.time[track_rows], self.positions[track_rows], tolerance)]
+            for track_rows in (
+                np.flatnonzero(self.track_ids == track_id)
+                for track_id in np.unique(self.track_ids)
+            )
+        ]
+        rows = np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+        return HistorySamples(
+            self.time[rows],
+            self.track_ids[rows],
+            self.positions[rows],
+            self.accuracy[rows]
+        )
+
+    @classmethod
+    def concat(cls, parts: list["HistorySamples"]) -> "HistorySamples":
+        if not parts:
+            return cls(
+                np.empty(0), np.empty(0, dtype=np.int64),
+                np.empty((0, 3)), np.empty(0)
+            )
+
+        time = np.concatenate([p.time for p in parts])
+        order = np.argsort(time, kind="stable")
+
+        return cls(
+            time[order],
+            np.concatenate([p.track_ids for p in parts])[order],
+            np.concatenate([p.positions for p in parts])[order],
+            np.concatenate([p.accuracy for p in parts])[order],
+        )
+
+
+class _Block:
+    """
+    append only columns of one time partition
+
+    rows below `size` never change. The rows of every track are in
+    capture order, since `HistoryStore.add` drops late samples.
+    """
+    __slots__ = (
+        "start", "first", "end", "size", "time", "track_ids",
+        "positions", "accuracy", "index", "sealed",
+    )
+
+    def __init__(self, start: float, capacity: int) -> None:
+        self.start = start
+        self.first = start  # oldest capture time in the block
+        self.end = start    # newest capture time in the block
+        self.size = 0
+
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.track_ids = np.empty(capacity, dtype=np.int64)
+        self.positions = np.empty((capacity, 3), dtype=np.float64)
+        self.accuracy = np.empty(capacity, dtype=np.float64)
+
+        # rows of every track, lists while appending, arrays once sealed
+        self.index: dict[int, list[int] | np.ndarray] = {}
+        self.sealed = False
+
+    def append(self, state: TrackState) -> None:
+        row = self.size
+
+        self.time[row] = state.time
+        self.track_ids[row] = state.track_id
+        self.positions[row] = state.position
+        self.accuracy[row] = state.accuracy
+
+        rows = self.index.get(state.track_id)
+        if rows is None:
+            rows = self.index[state.track_id] = []
+
+        rows.append(row)
+
+        self.first = min(self.first, state.time)
+        self.end = max(self.end, state.time)
+        self.size = row + 1
+
+    def seal(self) -> None:
+        """
+        freeze the block, it is only read from now on
+        """
+        self.index = {
+            track_id: np.array(rows, dtype=np.int64)
+            for track_id, rows in self.index.items()
+        }
+        self.sealed = True
+
+    def rows(self, rows: np.ndarray | slice) -> HistorySamples:
+        return HistorySamples(
+            self.time[rows],
+            self.track_ids[rows],
+            self.positions[rows],
+            self.accuracy[rows]
+        )
+
+
+class HistoryStore:
+    """
+    keeps the positions of all tracks for the last `retention` seconds
+
+    samples are appended to blocks of `block_seconds` capture time (or
+    `block_capacity` rows), every block indexes the rows of each track.
+    Queries only look at the blocks overlapping the requested time
+    range and select the rows of a track by binary search.
+
+    with a `tolerance`, the trajectory of every track is simplified
+    before storing (see `TrajectorySimplifier`), the stored samples
+    then reconstruct it with at most `tolerance` position error. The
+    newest samples of a track are stored up to one second late.
+
+    samples older than the newest one of their track are dropped, the
+    queries rely on the rows of a track being in capture order.
+
+    sealed blocks are passed to `on_seal` (e.g. `HistoryWriter.submit`),
+    which must not block. `add` and `seal` must only be called from one
+    thread, queries can run on any.
+    """
+    def __init__(
+            self,
+            retention: float = 600.,
+            block_seconds: float = 10.,
+            block_capacity: int = 4096,
+            on_seal: tp.Callable[[HistorySamples], tp.Any] | None = None,
+            tolerance: float | None = None
+    ) -> None:
+        self._retention = retention
+        self._block_seconds = block_seconds
+        self._block_capacity = block_capacity
+        self._on_seal = on_seal
+
+        self._tolerance = tolerance
+        self._simplifiers: dict[int, TrajectorySimplifier[TrackState]] = {}
+
+        # newest capture time added per track
+        self._last_times: dict[int, float] = {}
+
+        self._blocks: deque[_Block] = deque()
+        self._lock = threading.Lock()
+
+        metrics.gauge("history_blocks", lambda: len(self._blocks))
+
+    @property
+    def latest(self) -> float:
+        """
+        newest capture time in the store
+        """
+        blocks = self._blocks
+        return blocks[-1].end if blocks else float("-inf")
+
+    def add(self, state: TrackState) -> None:
+        """
+        add a solved position
+        """
+        _SAMPLES.inc()
+
+        last_time = self._last_times.get(state.track_id)
+        if last_time is not None and state.time <= last_time:
+            _LATE.inc()
+            return
+
+        self._last_times[state.track_id] = state.time
+
+        if self._tolerance is None:
+            return self._append(state)
+
+        simplifier = self._simplifiers.get(state.track_id)
+        if simplifier is None:
+            simplifier = self._simplifiers[state.track_id] = TrajectorySimplifier(
+                self._tolerance
+            )
+
+        for kept in simplifier.add(state.time, state.position, state):
+            self._append(kept)
+
+    def flush(self) -> None:
+        """
+        store all pending samples and seal the current block
+        """
+        for simplifier in self._simplifiers.values():
+            for kept in simplifier.flush():
+                self._append(kept)
+
+        self._simplifiers = {}
+        self.seal()
+
+    def _append(self, state: TrackState) -> None:
+        block = self._blocks[-1] if self._blocks else None
+
+        if block is None or block.sealed or block.size >= self._block_capacity or (
+                state.time - block.start >= self._block_seconds
+        ):
+            block = self._open_block(state.time)
+
+        # rows are only visible to readers once `size` is increased,
+        # the index list is shared with them
+        with self._lock:
+            block.append(state)
+
+        _STORED.inc()
+
+    def seal(self) -> None:
+        """
+        seal the current block
+        """
+        if not self._blocks or self._blocks[-1].sealed:
+            return
+
+        block = self._blocks[-1]
+        with self._lock:
+            block.seal()
+
+        if self._on_seal is not None:
+            self._on_seal(block.rows(slice(None, block.size)))
+
+    def _open_block(self, start: float) -> _Block:
+        self.seal()
+        block = _Block(start, self._block_capacity)
+
+        with self._lock:
+            self._blocks.append(block)
+
+            # forget blocks past the retention
+            while self._blocks[0].end < start - self._retention:
+                self._blocks.popleft()
+
+        # tracks without samples in the retention can start over
+        self._last_times = {
+            track_id: time for track_id, time in self._last_times.items()
+            if time >= start - self._retention
+        }
+
+        # the pending samples of lost tracks won't be decided on anymore
+        for track_id, simplifier in list(self._simplifiers.items()):
+            # leave room for the sample that opened the block
+            if block.size >= self._block_capacity - 1:
+                break
+
+            if simplifier.last_time < start - self._block_seconds:
+                del self._simplifiers[track_id]
+
+                for kept in simplifier.flush():
+                    with self._lock:
+                        block.append(kept)
+
+                    _STORED.inc()
+
+        return block
+
+    def _overlapping(self, t0: float, t1: float) -> list[tuple[_Block, int]]:
+        """
+        blocks that may contain samples in [t0, t1], with their size
+        """
+        with self._lock:
+            return [
+                (block, block.size) for block in self._blocks
+                if block.first <= t1 and block.end >= t0
+            ]
+
+    def track(self, track_id: int, t0: float, t1: float) -> HistorySamples:
+        """
+        positions of one track with capture time in [t0, t1]
+        """
+        with _QUERY_TIME.time():
+            parts = []
+            for block, size in self._overlapping(t0, t1):
+                with self._lock:
+                    rows = block.index.get(track_id)
+                    if rows is None:
+                        continue
+
+                    rows = np.asarray(rows, dtype=np.int64)
+
+                rows = rows[:np.searchsorted(rows, size)]
+                times = block.time[rows]
+
+                lower = np.searchsorted(times, t0, side="left")
+                upper = np.searchsorted(times, t1, side="right")
+                if upper > lower:
+                    parts.append(block.rows(rows[lower:upper]))
+
+            return HistorySamples.concat(parts)
+
+    def bbox(
+            self,
+            lower: tuple[float, float, float],
+            upper: tuple[float, float, float],
+            t0: float,
+            t1: float = float("inf")
+    ) -> HistorySamples:
+        """
+        positions of all tracks inside the box with capture time in [t0, t1]
+        """
+        lower = np.asarray(lower, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+
+        with _QUERY_TIME.time():
+            parts = []
+            for block, size in self._overlapping(t0, t1):
+                time = block.time[:size]
+                positions = block.positions[:size]
+
+                mask = (time >= t0) & (time <= t1)
+                mask &= np.all((positions >= lower) & (positions <= upper), axis=1)
+
+                rows = np.flatnonzero(mask)
+                if len(rows):
+                    parts.append(block.rows(rows))
+
+            return HistorySamples.concat(parts)
@@ -0,0 +1,222 @@
+"""
+_history_writer.py
+11. January 2025
+
+writes sealed history blocks to memory mapped column files
+
+Author:
+Nilusink
+"""
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import threading
+import queue
+import json
+import os
+
+from numpy.lib.format import open_memmap
+import numpy as np
+
+from ..tools import debugger, run_with_debug
+from ..diagnostics import metrics, profiler
+from ._history_store import HistorySamples
+
+
+_FLUSH_TIME = metrics.histogram("history_writer_flush_seconds")
+_ROWS_WRITTEN = metrics.counter("history_writer_rows_total")
+_BLOCKS_DROPPED = metrics.counter("history_writer_dropped_blocks_total")
+
+# (name, dtype, shape of one row)
+_COLUMNS: tuple[tuple[str, type, tuple[int, ...]], ...] = (
+    ("time", np.float64, ()),
+    ("track_ids", np.int64, ()),
+    ("positions", np.float64, (3,)),
+    ("accuracy", np.float64, ()),
+)
+
+
+class HistoryWriter:
+    """
+    drains sealed blocks of a `HistoryStore` into chunk directories of
+    `.npy` column files, one directory per `chunk_rows` samples
+
+    chunk files are preallocated, the number of valid rows is stored in
+    the chunk's `meta.json`, which is only replaced after the columns
+    have been flushed to disk (every `flush_interval` seconds and on
+    rollover). `submit` never blocks, blocks are dropped if the writer
+    falls more than `max_queue` blocks behind.
+    """
+    def __init__(
+            self,
+            directory: str,
+            pool: ThreadPoolExecutor,
+            chunk_rows: int = 1 << 16,
+            flush_interval: float = 5.,
+            max_queue: int = 64
+    ) -> None:
+        self._directory = directory
+        self._pool = pool
+        self._chunk_rows = chunk_rows
+        self._flush_interval = flush_interval
+
+        self._queue: queue.Queue[HistorySamples] = queue.Queue(max_queue)
+
+        self._chunk_index = -1
+        self._chunk_dir = ""
+        self._columns: dict[str, np.memmap] = {}
+        self._rows = 0
+
+        self._write_thread: threading.Thread | None = None
+        self._running = False
+
+        metrics.gauge("history_writer_queue", self._queue.qsize)
+
+    def start(self) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+
+        # never overwrite chunks of earlier runs
+        self._chunk_index = max(
+            (int(name) for name in os.listdir(self._directory) if name.isdigit()),
+            default=-1
+        )
+
+        self._running = True
+        self._write_thread = threading.Thread(
+            target=self._write_loop,
+            name="history-writer"
+        )
+        self._write_thread.start()
+
+        debugger.info("HistoryWriter started")
+
+    def submit(self, samples: HistorySamples) -> bool:
+        """
+        queue samples for writing, returns False if they were dropped
+        """
+        try:
+            self._queue.put_nowait(samples)
+
+        except queue.Full:
+            _BLOCKS_DROPPED.inc()
+            return False
+
+        return True
+
+    @run_with_debug(show_finish=True, reraise_errors=True)
+    @profiler.role("history writer")
+    def _write_loop(self) -> None:
+        """
+        not meant to be called, should be run in a thread
+        """
+        last_flush = perf_counter()
+
+        while self._running or not self._queue.empty():
+            try:
+                self._write(self._queue.get(timeout=.2))
+
+            except queue.Empty:
+                pass
+
+            if perf_counter() - last_flush >= self._flush_interval:
+                self._flush()
+                last_flush = perf_counter()
+
+        self._flush()
+        self._columns = {}
+
+    def _write(self, samples: HistorySamples) -> None:
+        offset = 0
+        while offset < len(samples):
+            if not self._columns or self._rows >= self._chunk_rows:
+                self._rollover()
+
+            n = min(len(samples) - offset, self._chunk_rows - self._rows)
+
+            for name, _, _ in _COLUMNS:
+                self._columns[name][self._rows:self._rows + n] = (
+                    getattr(samples, name)[offset:offset + n]
+                )
+
+            self._rows += n
+            offset += n
+            _ROWS_WRITTEN.inc(n)
+
+    def _rollover(self) -> None:
+        """
+        finish the current chunk and open the next one
+        """
+        if self._columns:
+            self._flush()
+
+        self._chunk_index += 1
+        self._chunk_dir = os.path.join(self._directory, f"{self._chunk_index:06d}")
+        os.makedirs(self._chunk_dir)
+
+        self._columns = {
+            name: open_memmap(
+                os.path.join(self._chunk_dir, f"{name}.npy"),
+                mode="w+",
+                dtype=dtype,
+                shape=(self._chunk_rows, *shape)
+            ) for name, dtype, shape in _COLUMNS
+        }
+        self._rows = 0
+        self._write_meta()
+
+        debugger.info(f"HistoryWriter: writing chunk {self._chunk_dir}")
+
+    def _flush(self) -> None:
+        if not self._columns:
+            return
+
+        with _FLUSH_TIME.time():
+            for column in self._columns.values():
+                column.flush()
+
+            self._write_meta()
+
+    def _write_meta(self) -> None:
+        path = os.path.join(self._chunk_dir, "meta.json")
+
+        with open(path + ".tmp", "w") as out:
+            json.dump({"rows": self._rows}, out)
+            out.flush()
+            os.fsync(out.fileno())
+
+        os.replace(path + ".tmp", path)
+
+    def stop(self) -> None:
+        """
+        write everything still queued and close the current chunk
+        """
+        self._running = False
+
+        if self._write_thread is not None:
+            self._write_thread.join()
+
+        debugger.info("HistoryWriter shut down")
+
+
+def load_history(directory: str) -> list[HistorySamples]:
+    """
+    memory map every chunk written by a `HistoryWriter`, in write order.
+    Chunks without a meta file (a crash while opening them) are skipped.
+    """
+    chunks = []
+    for name in sorted(n for n in os.listdir(directory) if n.isdigit()):
+        chunk_dir = os.path.join(directory, name)
+
+        try:
+            with open(os.path.join(chunk_dir, "meta.json")) as inp:
+                rows = json.load(inp)["rows"]
+
+        except FileNotFoundError:
+            debugger.warning(f"load_history: skipping incomplete chunk {chunk_dir}")
+            continue
+
+        chunks.append(HistorySamples(*(
+            np.load(os.path.join(chunk_dir, f"{column}.npy"), mmap_mode="r")[:rows]
+            for column, _, _ in _COLUMNS
+        )))
+
+    return chunks
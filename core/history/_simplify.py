@@ -0,0 +1,138 @@
+"""
+_simplify.py
+13. January 2025
+
+online trajectory simplification with a maximum position error
+
+Author:
+Nilusink
+"""
+import typing as tp
+
+import numpy as np
+
+
+T = tp.TypeVar("T")
+
+
+class TrajectorySimplifier(tp.Generic[T]):
+    """
+    streaming (opening window) simplification of one trajectory
+
+    a sample is only kept if the trajectory can't be reconstructed by
+    linear interpolation in time between the kept samples with an error
+    of at most `tolerance`. Every sample carries an arbitrary payload,
+    `add` returns the payloads of the samples that have been decided on.
+
+    the newest sample is always pending, it is kept as soon as the next
+    sample starts a new segment or the segment spans `max_gap` seconds
+    or `max_pending` samples.
+    """
+    __slots__ = (
+        "_tolerance", "_max_gap", "_max_pending",
+        "_anchor", "_times", "_positions", "_payloads",
+    )
+
+    def __init__(
+            self,
+            tolerance: float,
+            max_gap: float = 1.,
+            max_pending: int = 256
+    ) -> None:
+        self._tolerance = tolerance
+        self._max_gap = max_gap
+        self._max_pending = max_pending
+
+        # last kept sample (time, position)
+        self._anchor: tuple[float, np.ndarray] | None = None
+
+        # samples after the anchor, the last one is the segment end
+        self._times: list[float] = []
+        self._positions: list[np.ndarray] = []
+        self._payloads: list[T] = []
+
+    @property
+    def last_time(self) -> float:
+        if self._times:
+            return self._times[-1]
+
+        return float("-inf") if self._anchor is None else self._anchor[0]
+
+    def add(self, time: float, position: np.ndarray, payload: T) -> list[T]:
+        """
+        add the next sample, returns the payloads to keep
+        """
+        if self._anchor is None:
+            self._anchor = (time, position)
+            return [payload]
+
+        kept = []
+        if self._times and not self._fits(time, position):
+            kept.append(self._keep_last())
+
+        self._times.append(time)
+        self._positions.append(position)
+        self._payloads.append(payload)
+
+        if len(self._times) >= self._max_pending or (
+                time - self._anchor[0] >= self._max_gap
+        ):
+            kept.append(self._keep_last())
+
+        return kept
+
+    def flush(self) -> list[T]:
+        """
+        keep the pending segment end, e.g. when the track is lost
+        """
+        if not self._times:
+            return []
+
+        return [self._keep_last()]
+
+    def _fits(self, time: float, position: np.ndarray) -> bool:
+        """
+        check if all pending samples are within the tolerance of the
+        segment from the anchor to the new sample
+        """
+        anchor_time, anchor_position = self._anchor
+
+        duration = time - anchor_time
+        if duration <= 0:
+            return False
+
+        times = np.array(self._times)
+        f = ((times - anchor_time) / duration)[:, None]
+        expected = anchor_position + (position - anchor_position) * f
+
+        errors = np.sum((np.array(self._positions) - expected) ** 2, axis=1)
+        return bool(np.all(errors <= self._tolerance ** 2))
+
+    def _keep_last(self) -> T:
+        """
+        make the pending segment end the new anchor
+        """
+        payload = self._payloads[-1]
+        self._anchor = (self._times[-1], self._positions[-1])
+
+        self._times.clear()
+        self._positions.clear()
+        self._payloads.clear()
+
+        return payload
+
+
+def simplify(times: np.ndarray, positions: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    indices of the samples of one trajectory to keep
+    """
+    simplifier: TrajectorySimplifier[int] = TrajectorySimplifier(
+        tolerance, max_gap=float("inf"), max_pending=len(times) + 1
+    )
+
+    kept = []
+    for i, (time, position) in enumerate(zip(times.tolist(), positions)):
+        kept.extend(simplifier.add(time, position, i))
+
+    kept.extend(simplifier.flush())
+    return np.array(kept, dtype=np.int64)
@@ -1,2 +1,5 @@
-from ._types import CameraResult
-from ._solve import solve
+from ._types import CameraResult, Measurement, CameraRecord, TrackState, polar_to_cartesian
+from ._solve import solve, solve_rays
+from ._accuracy import AccuracyVolume
+from ._solve_cache import SolveCache
+from ._backends import Backend, select_backend, get_backend, register_backend, available_backends
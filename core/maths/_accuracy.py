@@ -0,0 +1,209 @@
+"""
+_accuracy.py
+20. January 2025
+
+expected triangulation error over the covered airspace
+
+Author:
+Nilusink
+"""
+import typing as tp
+
+import numpy as np
+
+from ._types import CameraRecord, polar_to_cartesian
+
+
+class AccuracyVolume:
+    """
+    expected position error on a regular 3d grid for one camera layout
+
+    every camera measures the direction to a point with an angular
+    error of `angle_error` (radians, standard deviation per axis), so it
+    constrains the point perpendicular to its ray with
+    `angle_error * distance`. The expected error of a cell is the rms
+    error of the combined constraints of all cameras that see it (sqrt
+    of the trace of the inverse information matrix), inf for cells seen
+    by fewer than two cameras or only along one line.
+
+    `residuals` holds what the solver reports as accuracy for a point in
+    the cell: the expected mean distance of the solution to the rays of
+    the cameras that see it, so solutions can be compared against it.
+    """
+    __slots__ = ("version", "lower", "cell_size", "angle_error", "errors", "residuals")
+
+    def __init__(
+            self,
+            version: int,
+            lower: np.ndarray,
+            cell_size: float,
+            angle_error: float,
+            errors: np.ndarray,
+            residuals: np.ndarray
+    ) -> None:
+        self.version = version          # camera configuration version
+        self.lower = lower              # (3,) corner of the first cell
+        self.cell_size = cell_size
+        self.angle_error = angle_error
+        self.errors = errors            # (nx, ny, nz) float32
+        self.residuals = residuals      # (nx, ny, nz) float32
+
+    @classmethod
+    def build(
+            cls,
+            cams: tp.Iterable[CameraRecord],
+            version: int,
+            cell_size: float = 5.,
+            max_range: float = 500.,
+            height: float = 150.,
+            half_fov: float = np.radians(60),
+            angle_error: float = 1e-3,
+            chunk: int = 1 << 15
+    ) -> "AccuracyVolume":
+        """
+        compute the grid over the cameras' bounding box, extended by
+        `max_range` horizontally and `height` upwards
+        """
+        cams = list(cams)
+        origins = np.array([cam.origin for cam in cams], dtype=np.float64).reshape(-1, 3)
+        axes = polar_to_cartesian(
+            np.array([cam.angle_xy for cam in cams], dtype=np.float64),
+            np.array([cam.angle_xz for cam in cams], dtype=np.float64),
+            1.
+        ).reshape(-1, 3)
+
+        if len(cams):
+            lower = origins.min(axis=0) - (max_range, max_range, 0)
+            upper = origins.max(axis=0) + (max_range, max_range, height)
+
+        else:
+            lower = upper = np.zeros(3)
+
+        shape = tuple(np.maximum(np.ceil((upper - lower) / cell_size), 1).astype(int))
+
+        # cell centers, processed in chunks to bound the memory
+        centers = np.stack(np.meshgrid(
+            *((np.arange(n) + .5) * cell_size + lo for n, lo in zip(shape, lower)),
+            indexing="ij"
+        ), axis=-1).reshape(-1, 3)
+
+        errors = np.empty(len(centers), dtype=np.float32)
+        residuals = np.empty(len(centers), dtype=np.float32)
+        cos_fov = np.cos(half_fov)
+        for start in range(0, len(centers), chunk):
+            (
+                errors[start:start + chunk],
+                residuals[start:start + chunk]
+            ) = _expected_errors(
+                centers[start:start + chunk],
+                origins,
+                axes,
+                cos_fov,
+                max_range,
+                angle_error
+            )
+
+        return cls(
+            version,
+            lower,
+            cell_size,
+            angle_error,
+            errors.reshape(shape),
+            residuals.reshape(shape)
+        )
+
+    def _index(self, position: tp.Sequence[float]) -> tuple[int, ...] | None:
+        index = tuple(((np.asarray(position) - self.lower) // self.cell_size).astype(int))
+
+        if any(i < 0 or i >= n for i, n in zip(index, self.errors.shape)):
+            return None
+
+        return index
+
+    def lookup(self, position: tp.Sequence[float]) -> float:
+        """
+        expected error at `position`, inf outside of the grid
+        """
+        index = self._index(position)
+        return float("inf") if index is None else float(self.errors[index])
+
+    def expected_residual(self, position: tp.Sequence[float]) -> float:
+        """
+        expected solver accuracy (mean ray distance) at `position`, inf
+        outside of the grid
+        """
+        index = self._index(position)
+        return float("inf") if index is None else float(self.residuals[index])
+
+    def export(self, path: str) -> None:
+        """
+        save the grid for layout planning (`numpy.load` compatible)
+        """
+        np.savez(
+            path,
+            version=self.version,
+            lower=self.lower,
+            cell_size=self.cell_size,
+            angle_error=self.angle_error,
+            errors=self.errors,
+            residuals=self.residuals
+        )
+
+
+def _expected_errors(
+        points: np.ndarray,
+        origins: np.ndarray,
+        axes: np.ndarray,
+        cos_fov: float,
+        max_range: float,
+        angle_error: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    rms triangulation error and expected mean ray distance at every
+    point (m, 3)
+    """
+    information = np.zeros((len(points), 3, 3))
+    seen = np.zeros(len(points), dtype=np.int64)
+    distance_sum = np.zeros(len(points))
+
+    for origin, axis in zip(origins, axes):
+        rays = points - origin
+        distances = np.linalg.norm(rays, axis=1)
+        rays /= np.maximum(distances, 1e-9)[:, None]
+
+        visible = (rays @ axis >= cos_fov) & (distances <= max_range) & (distances > 0)
+        weights = np.where(visible, 1 / np.maximum(angle_error * distances, 1e-9) ** 2, 0.)
+
+        # constraint perpendicular to the ray: w * (I - r rᵀ)
+        information += weights[:, None, None] * (
+            np.eye(3) - rays[:, :, None] * rays[:, None, :]
+        )
+        seen += visible
+        distance_sum += np.where(visible, distances, 0.)
+
+    # trace of the inverse of the symmetric 3x3 matrices, via the
+    # diagonal of their adjugates
+    a, b, c = information[:, 0, 0], information[:, 1, 1], information[:, 2, 2]
+    d, e, f = information[:, 0, 1], information[:, 1, 2], information[:, 0, 2]
+
+    adjugate_trace = (b * c - e * e) + (a * c - f * f) + (a * b - d * d)
+    determinant = a * (b * c - e * e) - d * (d * c - e * f) + f * (d * e - b * f)
+
+    # parallel rays only constrain two axes
+    scale = ((a + b + c) / 3) ** 3
+    solvable = (seen >= 2) & (determinant > 1e-9 * scale)
+
+    errors = np.full(len(points), np.inf)
+    errors[solvable] = np.sqrt(adjugate_trace[solvable] / determinant[solvable])
+
+    # the perpendicular offset of a ray is 2d normal with
+    # `angle_error * distance` per axis, its mean length is sqrt(pi / 2)
+    # times that. The fit absorbs 3 of the 2n degrees of freedom.
+    n = seen[solvable]
+    residuals = np.full(len(points), np.inf)
+    residuals[solvable] = (
+        angle_error * distance_sum[solvable] / n
+        * np.sqrt(np.pi / 2 * (2 * n - 3) / (2 * n))
+    )
+
+    return errors, residuals
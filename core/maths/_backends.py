@@ -0,0 +1,149 @@
+"""
+_backends.py
+30. January 2025
+
+interchangeable implementations of the numeric hot paths
+
+Author:
+Nilusink
+"""
+import typing as tp
+
+import numpy as np
+
+from ..tools import debugger
+from ._types import polar_to_cartesian
+
+
+class Backend:
+    """
+    one set of kernels, all backends compute the same results (up to
+    floating point rounding)
+
+    polar_to_cartesian(angle_xy (n,), angle_xz (n,), length) -> (n, 3)
+    line_distances(point (3,), origins (n, 3), directions (n, 3)) -> (n,)
+        squared distance of the point to every line
+    objective(point (3,), origins (n, 3), directions (n, 3)) -> float
+        sum of the squared distances, minimized by the solver
+    """
+    __slots__ = ("name", "polar_to_cartesian", "line_distances", "objective")
+
+    def __init__(
+            self,
+            name: str,
+            polar_to_cartesian: tp.Callable[[np.ndarray, np.ndarray, float], np.ndarray],
+            line_distances: tp.Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+            objective: tp.Callable[[np.ndarray, np.ndarray, np.ndarray], float]
+    ) -> None:
+        self.name = name
+        self.polar_to_cartesian = polar_to_cartesian
+        self.line_distances = line_distances
+        self.objective = objective
+
+    def __repr__(self) -> str:
+        return f"<Backend {self.name}>"
+
+
+def _line_distances(
+        point: np.ndarray,
+        origins: np.ndarray,
+        directions: np.ndarray
+) -> np.ndarray:
+    # plain ufuncs, einsum has more call overhead for a few rows
+    offsets = point - origins
+    projection = (offsets * directions).sum(1) / (directions * directions).sum(1)
+    distances = offsets - projection[:, None] * directions
+    return (distances * distances).sum(1)
+
+
+def _objective(
+        point: np.ndarray,
+        origins: np.ndarray,
+        directions: np.ndarray
+) -> float:
+    return float(_line_distances(point, origins, directions).sum())
+
+
+def _numpy_backend() -> Backend:
+    return Backend("numpy", polar_to_cartesian, _line_distances, _objective)
+
+
+def _numba_backend() -> Backend:
+    # compiles the kernels, raises ImportError if numba is not installed
+    from ._numba_backend import make_backend
+    return make_backend()
+
+
+# name: factory, backends are only built once selected
+_FACTORIES: dict[str, tp.Callable[[], Backend]] = {
+    "numpy": _numpy_backend,
+    "numba": _numba_backend,
+}
+
+# tried in this order by "auto"
+_PREFERENCE: tuple[str, ...] = ("numba", "numpy")
+
+_backend: Backend = _numpy_backend()
+
+
+def register_backend(name: str, factory: tp.Callable[[], Backend]) -> None:
+    """
+    make a backend selectable, `factory` may raise ImportError if a
+    dependency is missing
+    """
+    _FACTORIES[name] = factory
+
+
+def available_backends() -> list[str]:
+    """
+    names of all backends that can be built in this environment
+    """
+    available = []
+    for name, factory in _FACTORIES.items():
+        try:
+            factory()
+
+        except ImportError:
+            continue
+
+        available.append(name)
+
+    return available
+
+
+def select_backend(name: str = "auto") -> Backend:
+    """
+    build a backend and use it for all following computations
+
+    "auto" uses the first backend of the preference list whose
+    dependencies are installed. Selecting should happen at startup,
+    before tracking (or forking the shards) starts.
+    """
+    global _backend
+
+    if name == "auto":
+        for candidate in _PREFERENCE:
+            try:
+                backend = _FACTORIES[candidate]()
+                break
+
+            except ImportError as error:
+                debugger.info(f"compute backend {candidate} not available: {error}")
+
+        else:
+            backend = _numpy_backend()
+
+    elif name in _FACTORIES:
+        backend = _FACTORIES[name]()
+
+    else:
+        raise ValueError(f"unknown compute backend: {name}")
+
+    _backend = backend
+    debugger.info(f"using compute backend {backend.name}")
+
+    return backend
+
+
+def get_backend() -> Backend:
+    return _backend
@@ -0,0 +1,71 @@
+"""
+_numba_backend.py
+30. January 2025
+
+compiled kernels, only imported if numba is installed and selected
+
+Author:
+Nilusink
+"""
+import numba
+import numpy as np
+
+from ._backends import Backend
+
+
+@numba.njit(cache=True)
+def _polar_to_cartesian(
+        angle_xy: np.ndarray,
+        angle_xz: np.ndarray,
+        length: float
+) -> np.ndarray:
+    out = np.empty((angle_xy.shape[0], 3))
+    for i in range(angle_xy.shape[0]):
+        cos_xz = np.cos(angle_xz[i])
+        out[i, 0] = length * cos_xz * np.cos(angle_xy[i])
+        out[i, 1] = length * cos_xz * np.sin(angle_xy[i])
+        out[i, 2] = length * np.sin(angle_xz[i])
+
+    return out
+
+
+@numba.njit(cache=True)
+def _line_distances(
+        point: np.ndarray,
+        origins: np.ndarray,
+        directions: np.ndarray
+) -> np.ndarray:
+    out = np.empty(origins.shape[0])
+    for i in range(origins.shape[0]):
+        ox = point[0] - origins[i, 0]
+        oy = point[1] - origins[i, 1]
+        oz = point[2] - origins[i, 2]
+        dx, dy, dz = directions[i, 0], directions[i, 1], directions[i, 2]
+
+        projection = (ox * dx + oy * dy + oz * dz) / (dx * dx + dy * dy + dz * dz)
+        ox -= projection * dx
+        oy -= projection * dy
+        oz -= projection * dz
+        out[i] = ox * ox + oy * oy + oz * oz
+
+    return out
+
+
+@numba.njit(cache=True)
+def _objective(
+        point: np.ndarray,
+        origins: np.ndarray,
+        directions: np.ndarray
+) -> float:
+    return _line_distances(point, origins, directions).sum()
+
+
+def make_backend() -> Backend:
+    # compile now instead of on the first measurement, for contiguous
+    # arrays and for the column views the tracker passes
+    angles = np.zeros((2, 2))
+    _polar_to_cartesian(angles[:, 0], angles[:, 1], 1.)
+    directions = _polar_to_cartesian(np.zeros(2), np.zeros(2), 1.)
+    _objective(np.zeros(3), np.zeros((2, 3)), directions)
+
+    return Backend("numba", _polar_to_cartesian, _line_distances, _objective)
@@ -7,11 +7,24 @@ the actual calculation
 Author:
 Nilusink
 """
-from scipy.optimize import minimize
+from functools import cache
+import typing as tp
+
 import numpy as np
 
-from ..tools import Vec3, debugger, run_with_debug
+from ..tools import Vec3, run_with_debug
+from ..diagnostics import tracer
 from ._types import CameraResult
+from ._backends import get_backend
+
+
+@cache
+def _minimize() -> tp.Callable:
+    """
+    scipy takes long to import, so it is only loaded for the first solve
+    """
+    from scipy.optimize import minimize
+    return minimize
 
 
 # @run_with_debug(show_finish=True, reraise_errors=True)
@@ -21,29 +34,40 @@ def solve(*results: CameraResult) -> tuple[Vec3, float]:
     3-dimensional space
     """
     # convert values to numpy vector format
-    lines: list[tuple[np.array, np.array]] = []
-    for result in results:
-        lines.append((
-            np.array(result.origin.xyz),
-            np.array(result.direction.xyz),
-        ))
-
-    result = minimize(
-        objective,
+    origins = np.array([result.origin.xyz for result in results])
+    directions = np.array([result.direction.xyz for result in results])
+
+    position, accuracy = solve_rays(origins, directions)
+    return Vec3.from_cartesian(*position), accuracy
+
+
+def solve_rays(
+        origins: np.ndarray,
+        directions: np.ndarray
+) -> tuple[np.ndarray, float]:
+    """
+    closest point to all rays given as (n, 3) arrays of origins and
+    directions, returns the point and the average distance to the rays
+    """
+    backend = get_backend()
+    origins = np.ascontiguousarray(origins, dtype=np.float64)
+    directions = np.ascontiguousarray(directions, dtype=np.float64)
+
+    result = _minimize()(
+        backend.objective,
         x0=np.array([0.0, 0.0, 0.0]),
-        args=(lines,),
+        args=(origins, directions),
         method='BFGS'
     )
 
     if result.success:
         # calculate accuracy parameter (average distance to path)
-        distances = [
-            np.sqrt(distance_to_line(result.x, line[0], line[1])) for line in lines
-        ]
-        av_dist = sum(distances) / len(distances)
-        debugger.trace(f"av distance: {av_dist}")
+        distances = np.sqrt(backend.line_distances(result.x, origins, directions))
+        av_dist = distances.mean()
+        if __debug__:
+            tracer.trace("av distance: {}", av_dist)
 
-        return Vec3.from_cartesian(*result.x), av_dist
+        return result.x, float(av_dist)
 
     else:
         raise ValueError("Optimization failed: " + result.message)
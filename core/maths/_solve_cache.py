@@ -0,0 +1,78 @@
+"""
+_solve_cache.py
+22. January 2025
+
+remembers solutions of (nearly) identical camera angles
+
+Author:
+Nilusink
+"""
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+from ..diagnostics import metrics
+
+
+# (camera version, camera ids, quantized angles)
+Key = tuple[int, bytes, bytes]
+
+
+class SolveCache:
+    """
+    least recently used cache of solver results
+
+    angles are quantized to `resolution` radians, so static or hovering
+    targets hit the cache although their angles jitter slightly. The
+    camera configuration version is part of the key, entries of older
+    versions are never returned (`clear` frees them).
+    """
+    def __init__(self, capacity: int = 4096, resolution: float = 1e-4) -> None:
+        self._capacity = capacity
+        self._resolution = resolution
+
+        self._entries: OrderedDict[Key, tuple[np.ndarray, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = metrics.counter("solve_cache_hits_total")
+        self._misses = metrics.counter("solve_cache_misses_total")
+        metrics.gauge("solve_cache_entries", lambda: len(self._entries))
+        metrics.gauge("solve_cache_hit_ratio", lambda: self.hit_ratio)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self._hits.value + self._misses.value
+        return self._hits.value / total if total else 0.
+
+    def key(self, version: int, cam_ids: np.ndarray, angles: np.ndarray) -> Key:
+        return (
+            version,
+            np.ascontiguousarray(cam_ids, dtype=np.int64).tobytes(),
+            np.round(angles / self._resolution).astype(np.int64).tobytes()
+        )
+
+    def get(self, key: Key) -> tuple[np.ndarray, float] | None:
+        with self._lock:
+            result = self._entries.get(key)
+
+            if result is None:
+                self._misses.inc()
+                return None
+
+            self._entries.move_to_end(key)
+
+        self._hits.inc()
+        return result
+
+    def put(self, key: Key, position: np.ndarray, accuracy: float) -> None:
+        with self._lock:
+            self._entries[key] = (position, accuracy)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -8,7 +8,11 @@ Author:
 Nilusink
 """
 from dataclasses import dataclass
+from time import perf_counter
 
+import numpy as np
+
+from ..tools.comms import TResData, CamAngle, SInfData, TRes3Data, CamAngle3
 from ..tools import Vec3
 
 
@@ -16,3 +20,139 @@ from ..tools import Vec3
 class CameraResult:
     origin: Vec3
     direction: Vec3
+
+
+def polar_to_cartesian(
+        angle_xy: np.ndarray,
+        angle_xz: np.ndarray,
+        length: float
+) -> np.ndarray:
+    """
+    vectorized `Vec3.from_polar`, returns an (n, 3) array
+    """
+    cos_xz = np.cos(angle_xz)
+    return length * np.stack((
+        cos_xz * np.cos(angle_xy),
+        cos_xz * np.sin(angle_xy),
+        np.sin(angle_xz),
+    ), axis=-1)
+
+
+# internal records, pydantic models are only used by the DataClient
+# and DataServer to talk to the outside
+class Measurement:
+    """
+    the angles of one track at one capture time, one row per camera
+    """
+    __slots__ = ("track_id", "time", "received", "cam_ids", "angles")
+
+    def __init__(
+            self,
+            track_id: int,
+            time: float,
+            cam_ids: np.ndarray,
+            angles: np.ndarray,
+            received: float | None = None
+    ) -> None:
+        self.track_id = track_id
+        self.time = time  # capture time
+        self.received = perf_counter() if received is None else received
+        self.cam_ids = cam_ids  # (n,) int
+        self.angles = angles    # (n, 2) float, (angle xy, angle xz)
+
+    @classmethod
+    def from_message(
+            cls,
+            result: TResData,
+            time: float,
+            cam_id_offset: int = 0
+    ) -> "Measurement":
+        return cls(
+            result.track_id,
+            time,
+            np.fromiter(
+                (ca.cam_id + cam_id_offset for ca in result.cam_angles),
+                dtype=np.int64,
+                count=len(result.cam_angles)
+            ),
+            np.array(
+                [ca.direction for ca in result.cam_angles],
+                dtype=np.float64
+            ).reshape(-1, 2)
+        )
+
+    def to_message(self) -> TResData:
+        return TResData(track_id=self.track_id, cam_angles=[
+            CamAngle(cam_id=int(cam_id), direction=(float(a[0]), float(a[1])))
+            for cam_id, a in zip(self.cam_ids, self.angles)
+        ])
+
+
+class CameraRecord:
+    """
+    station information with its geometry precomputed for the solver
+    """
+    __slots__ = ("info", "id", "origin", "angle_xy", "angle_xz")
+
+    def __init__(self, info: SInfData) -> None:
+        self.info = info
+        self.id = info.id
+        self.origin = np.array(info.position, dtype=np.float64)
+
+        direction = Vec3.from_cartesian(*info.direction).normalize()
+        self.angle_xy = direction.angle_xy
+        self.angle_xz = direction.angle_xz
+
+
+class TrackState:
+    """
+    solved position of a track, including the camera rays it came from
+    """
+    __slots__ = (
+        "track_id", "track_type", "position", "accuracy",
+        "time", "received", "cam_ids", "origins", "directions",
+        "velocity", "velocity_error",
+    )
+
+    def __init__(
+            self,
+            track_id: int,
+            track_type: int,
+            position: np.ndarray,
+            accuracy: float,
+            time: float,
+            received: float,
+            cam_ids: np.ndarray,
+            origins: np.ndarray,
+            directions: np.ndarray,
+            velocity: np.ndarray | None = None,
+            velocity_error: float = 0.
+    ) -> None:
+        self.track_id = track_id
+        self.track_type = track_type
+        self.position = position      # (3,)
+        self.accuracy = accuracy
+        self.time = time              # capture time
+        self.received = received      # perf_counter when it was received
+        self.cam_ids = cam_ids        # (n,)
+        self.origins = origins        # (n, 3)
+        self.directions = directions  # (n, 3)
+        self.velocity = velocity      # (3,), None if not known yet
+        self.velocity_error = velocity_error
+
+    def to_message(self) -> TRes3Data:
+        return TRes3Data(
+            track_id=self.track_id,
+            track_type=self.track_type,
+            position=tuple(self.position.tolist()),
+            accuracy=float(self.accuracy),
+            cam_angles=[CamAngle3(
+                cam_id=cam_id,
+                position=tuple(origin),
+                direction=tuple(direction)
+            ) for cam_id, origin, direction in zip(
+                self.cam_ids.tolist(),
+                self.origins.tolist(),
+                self.directions.tolist()
+            )]
+        )
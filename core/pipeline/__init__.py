@@ -0,0 +1 @@
+from ._compute_stage import ComputeStage, OverloadPolicy
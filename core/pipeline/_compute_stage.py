@@ -0,0 +1,229 @@
+"""
+_compute_stage.py
+09. December 2024
+
+bounded worker stage between the receiving and the tracking side
+
+Author:
+Nilusink
+"""
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from collections import deque
+from itertools import count
+from enum import Enum
+import typing as tp
+import threading
+
+from ..tools import debugger, run_with_debug
+from ..diagnostics import metrics, profiler
+
+
+T = tp.TypeVar("T")
+
+
+class OverloadPolicy(Enum):
+    shed_oldest = 0  # drop the oldest queued item of the same key
+    drop_newest = 1  # reject the submitted item
+    block = 2        # wait until there is room again
+
+
+class ComputeStage(tp.Generic[T]):
+    """
+    runs `handler` on a fixed number of worker threads, fed by a bounded
+    queue. `submit` never lets the queue grow past `max_pending`, what
+    happens on overload is decided by `policy`.
+
+    items are routed by `key` onto serial lanes: items with the same key
+    are handled one at a time in submission order, different keys run in
+    parallel. Without `key` every item gets its own lane.
+    """
+    def __init__(
+            self,
+            name: str,
+            handler: tp.Callable[[T], None],
+            key: tp.Callable[[T], tp.Hashable] | None = None,
+            workers: int = 4,
+            max_pending: int = 256,
+            policy: OverloadPolicy = OverloadPolicy.shed_oldest
+    ) -> None:
+        self._name = name
+        self._handler = handler
+        self._key = key
+        self._workers = workers
+        self._max_pending = max_pending
+        self._policy = policy
+
+        # one mailbox of (enqueue time, item) per key
+        self._lanes: dict[tp.Hashable, deque[tuple[float, T]]] = {}
+
+        # keys with queued items that no worker is running right now
+        self._ready: deque[tp.Hashable] = deque()
+
+        # keys that are either ready or being run by a worker
+        self._scheduled: set[tp.Hashable] = set()
+
+        self._pending = 0
+        self._sequence = count()
+        self._cond = threading.Condition()
+
+        # threading stuff
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self._running = False
+
+        # instrumentation
+        self._dropped = metrics.counter(f"{name}_dropped_total")
+        self._processed = metrics.counter(f"{name}_processed_total")
+        self._errors = metrics.counter(f"{name}_errors_total")
+        self._queue_time = metrics.histogram(f"{name}_queue_seconds")
+        self._handle_time = metrics.histogram(f"{name}_handle_seconds")
+        metrics.gauge(f"{name}_queue_depth", lambda: self.depth)
+        metrics.gauge(f"{name}_lanes", lambda: len(self._lanes))
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped.value
+
+    @property
+    def processed(self) -> int:
+        return self._processed.value
+
+    def start(self) -> None:
+        """
+        start the worker threads
+        """
+        self._running = True
+        for _ in range(self._workers):
+            self._pool.submit(self._worker_loop)
+
+        debugger.info(f"{self._name} stage started with {self._workers} workers")
+
+    def submit(self, item: T) -> bool:
+        """
+        queue an item, returns False if it was rejected
+        """
+        key = self._key(item) if self._key is not None else next(self._sequence)
+
+        with self._cond:
+            if self._pending >= self._max_pending:
+                match self._policy:
+                    case OverloadPolicy.drop_newest:
+                        self._dropped.inc()
+                        return False
+
+                    case OverloadPolicy.block:
+                        self._cond.wait_for(
+                            lambda: self._pending < self._max_pending
+                            or not self._running
+                        )
+
+                    case OverloadPolicy.shed_oldest:
+                        self._shed(key)
+
+            lane = self._lanes.setdefault(key, deque())
+            lane.append((perf_counter(), item))
+            self._pending += 1
+
+            if key not in self._scheduled:
+                self._scheduled.add(key)
+                self._ready.append(key)
+                self._cond.notify()
+
+        return True
+
+    def submit_many(self, items: tp.Iterable[T]) -> int:
+        """
+        queue several items at once, returns the number of accepted items
+        """
+        return sum(self.submit(item) for item in items)
+
+    def _shed(self, key: tp.Hashable) -> None:
+        """
+        drop the oldest queued item with the same key, or the head of the
+        longest waiting lane if there is none (must hold `_cond` and have
+        at least one item queued)
+        """
+        lane = self._lanes.get(key)
+
+        if not lane:
+            lane = next(
+                (self._lanes[k] for k in self._ready if self._lanes[k]),
+                None
+            )
+
+        # all queued items belong to lanes that are currently running
+        if not lane:
+            lane = next(l for l in self._lanes.values() if l)
+
+        lane.popleft()
+        self._pending -= 1
+        self._dropped.inc()
+
+    @run_with_debug(show_finish=True, reraise_errors=True)
+    def _worker_loop(self) -> None:
+        """
+        not meant to be called, should be run in a thread
+        """
+        with profiler.role(f"{self._name} stage"):
+            while self._running:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: self._ready, timeout=.2):
+                        continue
+
+                    key = self._ready.popleft()
+                    lane = self._lanes[key]
+
+                    # lane may have been emptied by shedding
+                    if not lane:
+                        self._retire(key)
+                        continue
+
+                    queued, item = lane.popleft()
+                    self._pending -= 1
+
+                    # wake up blocked submitters
+                    self._cond.notify_all()
+
+                start = perf_counter()
+                self._queue_time.observe(start - queued)
+
+                try:
+                    self._handler(item)
+
+                except Exception as e:
+                    self._errors.inc()
+                    debugger.warning(f"{self._name} stage: handler failed: {e!r}")
+
+                self._handle_time.observe(perf_counter() - start)
+                self._processed.inc()
+
+                # hand the lane back, it stays owned by this key until empty
+                with self._cond:
+                    if self._lanes[key]:
+                        self._ready.append(key)
+                        self._cond.notify()
+
+                    else:
+                        self._retire(key)
+
+    def _retire(self, key: tp.Hashable) -> None:
+        """
+        remove an empty lane (must hold `_cond`)
+        """
+        del self._lanes[key]
+        self._scheduled.discard(key)
+
+    def stop(self) -> None:
+        """
+        stop the workers, queued items are discarded
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        self._pool.shutdown(wait=True)
+        debugger.info(f"{self._name} stage shut down")
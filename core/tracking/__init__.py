@@ -1,2 +1,6 @@
 from ._tracking_master import TrackingMaster
-from ._track import Track
\ No newline at end of file
+from ._track import Track
+from ._sharded_tracking_master import ShardedTrackingMaster
+from ._camera_registry import CameraRegistry
+from ._frame_assembler import FrameAssembler
+from ._world_state import WorldState, WorldPublisher, TrackArrays
@@ -0,0 +1,71 @@
+"""
+_camera_registry.py
+12. December 2024
+
+all known camera stations, keyed by their global id
+
+Author:
+Nilusink
+"""
+from types import MappingProxyType
+import threading
+import typing as tp
+
+from ..tools.comms import SInfData
+from ..maths import CameraRecord
+
+
+class CameraRegistry:
+    """
+    stations of every upstream server, keyed by globally unique id,
+    stored as `CameraRecord`s with their solver geometry precomputed
+
+    the mapping is replaced instead of mutated on every update, so
+    readers never see it change while iterating. `version` increases
+    with every change of the camera configuration.
+    """
+    def __init__(self) -> None:
+        self._cams: dict[int, CameraRecord] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def cams(self) -> list[SInfData]:
+        return [record.info for record in self._cams.values()]
+
+    def __contains__(self, cam_id: int) -> bool:
+        return cam_id in self._cams
+
+    def __getitem__(self, cam_id: int) -> CameraRecord:
+        return self._cams[cam_id]
+
+    def __len__(self) -> int:
+        return len(self._cams)
+
+    def snapshot(self) -> tuple[int, tp.Mapping[int, CameraRecord]]:
+        """
+        the version and the (unchanging) records of that version
+        """
+        with self._lock:
+            return self._version, MappingProxyType(self._cams)
+
+    def update(self, cam: SInfData) -> bool:
+        """
+        add or replace a station, returns False if nothing changed
+        """
+        with self._lock:
+            current = self._cams.get(cam.id)
+            if current is not None and current.info == cam:
+                return False
+
+            cams = dict(self._cams)
+            cams[cam.id] = CameraRecord(cam)
+
+            self._cams = cams
+            self._version += 1
+
+        return True
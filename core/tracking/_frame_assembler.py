@@ -0,0 +1,330 @@
+"""
+_frame_assembler.py
+16. December 2024
+
+joins camera measurements of a track by their capture time
+
+Author:
+Nilusink
+"""
+from collections import deque
+import typing as tp
+
+import numpy as np
+
+from ..diagnostics import metrics
+from ..maths import Measurement
+
+
+# (capture time, (angle xy, angle xz))
+Sample = tuple[float, tuple[float, float]]
+
+_RELEASED = metrics.counter("frames_released_total")
+_TIMED_OUT = metrics.counter("frames_timed_out_total")
+_DROPPED = metrics.counter("frames_dropped_total")
+_LATE = metrics.counter("frames_late_measurements_total")
+_INTERPOLATED = metrics.counter("frames_interpolated_angles_total")
+_ADDED_LATENCY = metrics.histogram("frames_added_latency_seconds")
+
+
+class _Frame:
+    __slots__ = ("time", "received", "angles", "source")
+
+    def __init__(self, measurement: Measurement) -> None:
+        self.time = measurement.time
+        self.received = measurement.received
+
+        # the sample of every camera closest to `time`
+        self.angles: dict[int, Sample] = {}
+
+        # set while the frame consists of a single measurement
+        self.source: Measurement | None = measurement
+
+
+class _TrackBuffer:
+    __slots__ = ("samples", "frames", "watermark", "released")
+
+    def __init__(self) -> None:
+        self.samples: dict[int, deque[Sample]] = {}
+        self.frames: list[_Frame] = []
+
+        # newest capture time seen for this track
+        self.watermark = float("-inf")
+
+        # time of the newest frame released (or dropped)
+        self.released = float("-inf")
+
+
+class FrameAssembler:
+    """
+    buffers the camera measurements of every track and releases them as
+    frames of one capture instant
+
+    a frame is released as soon as every camera that reported the track
+    within `window` has a measurement within `tolerance` of the frame
+    time. Frames that stay incomplete are released once measurements
+    (of any track) `max_latency` newer than the frame have arrived,
+    missing angles are then interpolated from the camera's history where
+    possible. Frames with fewer than two cameras are dropped, so are
+    measurements not newer than the last released frame of their track
+    (frames are released in capture order).
+
+    released frames are passed to `on_frames` in batches, one call per
+    added message. `add` is not thread safe, it should be called from
+    the receive loop.
+    """
+    def __init__(
+            self,
+            on_frames: tp.Callable[[list[Measurement]], tp.Any],
+            tolerance: float = .02,
+            max_latency: float = .1,
+            window: float = 1.,
+            history: int = 32
+    ) -> None:
+        self._on_frames = on_frames
+        self._tolerance = tolerance
+        self._max_latency = max_latency
+        self._window = window
+        self._history = history
+
+        self._tracks: dict[int, _TrackBuffer] = {}
+        # newest capture time of all tracks, drives the timeouts
+        self._latest = float("-inf")
+        self._last_expire = float("-inf")
+        self._last_sweep = float("-inf")
+
+        metrics.gauge("frames_buffered_tracks", lambda: len(self._tracks))
+
+    def add(self, measurement: Measurement) -> None:
+        """
+        add the measurements of one track
+        """
+        self.add_many([measurement])
+
+    def add_many(self, measurements: list[Measurement]) -> None:
+        """
+        add the measurements of several tracks
+        """
+        released: list[Measurement] = []
+        for measurement in measurements:
+            self._latest = max(self._latest, measurement.time)
+            self._add(measurement, released)
+
+        # tracks without new measurements time out as well
+        if self._latest - self._last_expire >= self._max_latency:
+            self._expire(released)
+
+        if self._latest - self._last_sweep > self._window:
+            self._sweep(released)
+
+        if released:
+            self._on_frames(released)
+
+    def _add(self, measurement: Measurement, released: list[Measurement]) -> None:
+        capture_time = measurement.time
+
+        buffer = self._tracks.get(measurement.track_id)
+        if buffer is None:
+            buffer = self._tracks[measurement.track_id] = _TrackBuffer()
+
+        # too late, a newer frame of this track has already been released
+        if capture_time <= buffer.released:
+            _LATE.inc()
+            return
+
+        buffer.watermark = max(buffer.watermark, capture_time)
+        frame = self._frame_for(buffer, measurement)
+
+        for cam_id, direction in zip(
+                measurement.cam_ids.tolist(),
+                measurement.angles.tolist()
+        ):
+            sample = (capture_time, tuple(direction))
+
+            samples = buffer.samples.get(cam_id)
+            if samples is None:
+                samples = buffer.samples[cam_id] = deque(maxlen=self._history)
+
+            # late samples are not added to the history
+            if not samples or samples[-1][0] <= capture_time:
+                samples.append(sample)
+
+            current = frame.angles.get(cam_id)
+            if current is None or (
+                    abs(capture_time - frame.time) < abs(current[0] - frame.time)
+            ):
+                frame.angles[cam_id] = sample
+
+        self._release(measurement.track_id, buffer, released)
+
+    def _frame_for(self, buffer: _TrackBuffer, measurement: Measurement) -> _Frame:
+        """
+        get the pending frame closest to the capture time or open a new one
+        """
+        capture_time = measurement.time
+
+        best = None
+        for frame in buffer.frames:
+            offset = abs(frame.time - capture_time)
+
+            if offset <= self._tolerance and (
+                    best is None or offset < abs(best.time - capture_time)
+            ):
+                best = frame
+
+        if best is None:
+            best = _Frame(measurement)
+            buffer.frames.append(best)
+            buffer.frames.sort(key=lambda f: f.time)
+
+        else:
+            best.source = None
+
+        return best
+
+    def _release(
+            self,
+            track_id: int,
+            buffer: _TrackBuffer,
+            released: list[Measurement],
+            force: bool = False
+    ) -> None:
+        """
+        release all complete or timed out frames in capture order, or all
+        frames if `force` is set
+        """
+        expected = {
+            cam_id for cam_id, samples in buffer.samples.items()
+            if samples and samples[-1][0] >= buffer.watermark - self._window
+        }
+
+        # a single camera never completes a frame, it waits for the others
+        # (the track may have been seen by one camera only so far)
+        if len(expected) < 2:
+            expected = None
+
+        # everything older than the newest finished frame is finished too
+        last = len(buffer.frames) - 1 if force else -1
+        for i, frame in enumerate(buffer.frames):
+            if (expected is not None and expected <= frame.angles.keys()) or (
+                    self._latest - frame.time >= self._max_latency
+            ):
+                last = i
+
+        if last < 0:
+            return
+
+        finished = buffer.frames[:last + 1]
+        buffer.frames = buffer.frames[last + 1:]
+        buffer.released = max(buffer.released, finished[-1].time)
+
+        for frame in finished:
+            complete = expected is not None and expected <= frame.angles.keys()
+
+            # a single complete measurement is passed on unchanged
+            if complete and frame.source is not None:
+                _RELEASED.inc()
+                _ADDED_LATENCY.observe(self._latest - frame.time)
+                released.append(frame.source)
+                continue
+
+            if not complete:
+                _TIMED_OUT.inc()
+
+            cam_ids, angles = self._align(buffer, frame, expected or set())
+
+            if len(cam_ids) < 2:
+                _DROPPED.inc()
+                continue
+
+            _RELEASED.inc()
+            _ADDED_LATENCY.observe(self._latest - frame.time)
+
+            released.append(Measurement(
+                track_id,
+                frame.time,
+                np.array(cam_ids, dtype=np.int64),
+                np.array(angles, dtype=np.float64),
+                received=frame.received
+            ))
+
+    def _align(
+            self,
+            buffer: _TrackBuffer,
+            frame: _Frame,
+            expected: set[int]
+    ) -> tuple[list[int], list[tuple[float, float]]]:
+        """
+        angles of every camera at the frame time, interpolated if the
+        camera's history brackets it
+        """
+        cam_ids = []
+        angles = []
+        for cam_id in sorted(expected | frame.angles.keys()):
+            direction = self._interpolate(buffer.samples.get(cam_id), frame.time)
+
+            if direction is None:
+                if cam_id not in frame.angles:
+                    continue
+
+                direction = frame.angles[cam_id][1]
+
+            elif cam_id not in frame.angles or frame.angles[cam_id][0] != frame.time:
+                _INTERPOLATED.inc()
+
+            cam_ids.append(cam_id)
+            angles.append(direction)
+
+        return cam_ids, angles
+
+    @staticmethod
+    def _interpolate(
+            samples: deque[Sample] | None,
+            time: float
+    ) -> tuple[float, float] | None:
+        """
+        linearly interpolate a camera's angles to `time`
+        """
+        if not samples:
+            return None
+
+        previous = None
+        for sample in samples:
+            if sample[0] == time:
+                return sample[1]
+
+            if sample[0] > time:
+                if previous is None:
+                    return None
+
+                t0, (x0, y0) = previous
+                t1, (x1, y1) = sample
+                f = (time - t0) / (t1 - t0)
+
+                return x0 + (x1 - x0) * f, y0 + (y1 - y0) * f
+
+            previous = sample
+
+        return None
+
+    def _expire(self, released: list[Measurement]) -> None:
+        """
+        release the timed out frames of all tracks
+        """
+        self._last_expire = self._latest
+
+        for track_id, buffer in self._tracks.items():
+            if buffer.frames and self._latest - buffer.frames[0].time >= self._max_latency:
+                self._release(track_id, buffer, released)
+
+    def _sweep(self, released: list[Measurement]) -> None:
+        """
+        forget tracks that have not reported within the window, their
+        pending frames are released first
+        """
+        self._last_sweep = self._latest
+
+        for track_id, buffer in list(self._tracks.items()):
+            if self._latest - buffer.watermark > self._window:
+                self._release(track_id, buffer, released, force=True)
+                del self._tracks[track_id]
@@ -0,0 +1,245 @@
+"""
+_sharded_tracking_master.py
+06. December 2024
+
+Runs the tracking in several worker processes, sharded by track id
+
+Author:
+Nilusink
+"""
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from queue import Empty
+import multiprocessing as mp
+import typing as tp
+import threading
+import os
+
+from ..maths import Measurement, TrackState
+from ..tools.comms import SInfData
+from ..tools import debugger, run_with_debug
+from ..diagnostics import metrics, profiler
+from ._camera_registry import CameraRegistry
+from ._tracking_master import TrackingMaster
+from ._world_state import WorldState, WorldPublisher
+
+
+if tp.TYPE_CHECKING:
+    from ..comms import DataServer
+
+
+# shard inbox message kinds
+_CAM: int = 0
+_TRACK: int = 1
+_STOP: int = 2
+
+_MERGED = metrics.counter("sharded_results_total")
+_BATCHES = metrics.counter("sharded_batches_total")
+
+
+class _ShardSink:
+    """
+    stands in for the DataServer inside a shard process and collects
+    the track results of one batch
+    """
+    def __init__(self) -> None:
+        self.tm: TrackingMaster = ...
+        self._results: list[TrackState] = []
+
+    def update_clients(self, update: TrackState | SInfData) -> None:
+        # camera updates are forwarded by the main process
+        if isinstance(update, TrackState):
+            self._results.append(update)
+
+    def drain(self) -> list[TrackState]:
+        results = self._results
+        self._results = []
+        return results
+
+
+def _shard_main(inbox: mp.Queue, outbox: mp.Queue, batch_size: int) -> None:
+    """
+    entry point of a shard process
+    """
+    sink = _ShardSink()
+    tm = TrackingMaster(sink)
+
+    while True:
+        # block for the first item, then take whatever else is queued
+        batch = [inbox.get()]
+        while len(batch) < batch_size:
+            try:
+                batch.append(inbox.get_nowait())
+
+            except Empty:
+                break
+
+        for kind, payload in batch:
+            if kind == _STOP:
+                return
+
+            if kind == _CAM:
+                tm.update_cams(payload)
+                continue
+
+            try:
+                tm.update_tracks(payload)
+
+            except ValueError:
+                debugger.warning(f"shard failed to solve track {payload.track_id}")
+
+        results = sink.drain()
+        if results:
+            outbox.put(results)
+
+
+class ShardedTrackingMaster:
+    """
+    drop-in replacement for `TrackingMaster` that spreads the tracking
+    work over several processes
+
+    every track id is always handled by the same shard, so results of a
+    track are processed in the order they were passed to `update_tracks`.
+    Camera updates are broadcast to every shard. Must be started before
+    the pool starts any threads, since shards are forked. Tracks without
+    a measurement for `track_timeout` seconds are removed from `world`.
+    """
+    def __init__(
+            self,
+            data_server: "DataServer",
+            pool: ThreadPoolExecutor,
+            n_shards: int | None = None,
+            batch_size: int = 64,
+            track_timeout: float = 5.
+    ) -> None:
+        self._ds = data_server
+        self._pool = pool
+        self._n_shards = n_shards or os.cpu_count() or 1
+        self._batch_size = batch_size
+        self._cams = CameraRegistry()
+        self._world = WorldPublisher()
+        self._track_timeout = track_timeout
+
+        self._ctx = mp.get_context("fork")
+        self._inboxes: list[mp.Queue] = [
+            self._ctx.Queue() for _ in range(self._n_shards)
+        ]
+        self._outbox: mp.Queue = self._ctx.Queue()
+        self._shards: list[mp.Process] = []
+
+        # threading stuff
+        self._merge_thread: threading.Thread | None = None
+        self._running = False
+
+        # set tracking master for DataServer
+        self._ds.tm = self
+
+        for i, inbox in enumerate(self._inboxes):
+            metrics.gauge(f"sharded_inbox_depth_{i}", inbox.qsize)
+
+    @property
+    def cams(self) -> list[SInfData]:
+        return [record.info for record in self._world.current.cams.values()]
+
+    @property
+    def world(self) -> WorldState:
+        return self._world.current
+
+    @property
+    def cams_version(self) -> int:
+        return self._cams.version
+
+    def start(self) -> None:
+        """
+        fork the shard processes and start merging their results
+        """
+        for i, inbox in enumerate(self._inboxes):
+            shard = self._ctx.Process(
+                target=_shard_main,
+                args=(inbox, self._outbox, self._batch_size),
+                name=f"tracking-shard-{i}",
+                daemon=True
+            )
+            shard.start()
+            self._shards.append(shard)
+
+        self._running = True
+        self._merge_thread = threading.Thread(
+            target=self._merge_loop,
+            name="shard-merge",
+            daemon=True
+        )
+        self._merge_thread.start()
+
+        debugger.info(f"ShardedTrackingMaster started {self._n_shards} shards")
+
+    def update_cams(self, cam_update: SInfData) -> None:
+        """
+        update camera locations on every shard
+        """
+        debugger.log(f"Cam update for cam {cam_update.id}")
+
+        # servers resend their stations on reconnect
+        if not self._cams.update(cam_update):
+            return
+
+        self._world.publish_cams(*self._cams.snapshot())
+
+        for inbox in self._inboxes:
+            inbox.put((_CAM, cam_update))
+
+        # send update to clients
+        self._ds.update_clients(cam_update)
+
+    def update_tracks(self, measurement: Measurement) -> None:
+        """
+        forward a measurement to the shard owning its track
+        """
+        shard = measurement.track_id % self._n_shards
+        self._inboxes[shard].put((_TRACK, measurement))
+
+    @run_with_debug(show_finish=True, reraise_errors=True)
+    @profiler.role("shard merge loop")
+    def _merge_loop(self) -> None:
+        """
+        forwards shard results to the DataServer, should be run in a thread
+        """
+        next_expiry = 0.
+        while self._running:
+            # forget the tracks that stopped reporting, once a second
+            if perf_counter() >= next_expiry:
+                next_expiry = perf_counter() + 1.
+                self._world.expire(perf_counter() - self._track_timeout)
+
+            try:
+                results = self._outbox.get(timeout=.2)
+
+            except Empty:
+                continue
+
+            _BATCHES.inc()
+            _MERGED.inc(len(results))
+
+            # one snapshot per merged batch
+            self._world.publish_tracks(results)
+
+            for result in results:
+                self._ds.update_clients(result)
+
+    def stop(self) -> None:
+        """
+        stop all shards
+        """
+        debugger.trace("shutting down ShardedTrackingMaster")
+
+        for inbox in self._inboxes:
+            inbox.put((_STOP, None))
+
+        for shard in self._shards:
+            shard.join(timeout=1)
+
+        self._running = False
+        if self._merge_thread is not None:
+            self._merge_thread.join()
+
+        debugger.info("ShardedTrackingMaster shut down")
@@ -7,39 +7,107 @@ A signular track
 Author:
 Nilusink
 """
+from collections import deque
 from time import perf_counter
 
-from ..tools import Vec3, debugger
+import numpy as np
+
+from ..tools import debugger
+from ..diagnostics import tracer
 
 
 class Track:
-    def __init__(self, id: int, initial_position: Vec3) -> None:
+    """
+    a tracked object, only the positions of the last `window` seconds
+    are kept here (the long term history is in the `HistoryStore`)
+
+    the velocity is estimated from the capture times of the updates by
+    exponential smoothing (weight `smoothing` for the newest update)
+    """
+    def __init__(
+            self,
+            id: int,
+            initial_position: np.ndarray,
+            window: float = 10.,
+            time: float | None = None,
+            smoothing: float = .3
+    ) -> None:
         self._id = id
-        self._position_history: list[tuple[float, Vec3]] = [
+        self._window = window
+        self._position_history: deque[tuple[float, np.ndarray]] = deque([
             (perf_counter(), initial_position)
-        ]
+        ])
+
+        # (capture time, position) of the last update
+        self._last_capture = None if time is None else (time, initial_position)
+        self._smoothing = smoothing
+        self._velocity: np.ndarray | None = None
+        self._velocity_variance = 0.
 
         self._type = 0  # -1: degraded, 0: new, 1: valid
 
-        debugger.info(f"new track with id {self._id} at {initial_position.xyz}")
+        debugger.info(f"new track with id {self._id} at {initial_position.tolist()}")
 
     @property
     def id(self) -> int:
         return self._id
 
     @property
-    def current_position(self) -> Vec3:
+    def current_position(self) -> np.ndarray:
         return self._position_history[-1][1]
 
     @property
     def type(self) -> int:
         return self._type
 
-    def update_position(self, position: Vec3) -> None:
+    @property
+    def velocity(self) -> np.ndarray | None:
+        """
+        estimated velocity, None until the track has been seen twice
+        """
+        return self._velocity
+
+    @property
+    def velocity_error(self) -> float:
         """
-        update the tracks position
+        standard deviation of the measured velocities around the estimate
         """
-        debugger.trace(f"track {self.id} was updated by {position.xyz}")
-        self._position_history.append((perf_counter(), position))
+        return self._velocity_variance ** .5
+
+    def update_position(self, position: np.ndarray, time: float | None = None) -> None:
+        """
+        update the tracks position, `time` is the capture time
+        """
+        if __debug__:
+            tracer.trace("track {} was updated by {}", self.id, position)
+        now = perf_counter()
+        self._position_history.append((now, position))
+
+        while self._position_history[0][0] < now - self._window:
+            self._position_history.popleft()
+
+        if time is not None:
+            self._update_velocity(position, time)
 
         self._type = 1
+
+    def _update_velocity(self, position: np.ndarray, time: float) -> None:
+        last = self._last_capture
+        self._last_capture = (time, position)
+
+        if last is None or time <= last[0]:
+            return
+
+        measured = (position - last[1]) / (time - last[0])
+
+        if self._velocity is None:
+            self._velocity = measured
+            return
+
+        residual = measured - self._velocity
+        a = self._smoothing
+
+        self._velocity = self._velocity + a * residual
+        self._velocity_variance = (1 - a) * (
+            self._velocity_variance + a * float(residual @ residual)
+        )
@@ -7,106 +7,316 @@ Administers all tracks
 Author:
 Nilusink
 """
-from .. import CamAngle3
-from ..tools.comms import TResData, SInfData, TRes3Data
-from ..maths import CameraResult, solve
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import threading
+
+import numpy as np
+
+from ..maths import Measurement, TrackState, AccuracyVolume, SolveCache
+from ..maths import solve_rays, get_backend
+from ..diagnostics import metrics, tracer, profiler
+from ..tools.comms import SInfData
 from ..comms import DataServer
-from ..tools import debugger
+from ..tools import debugger, run_with_debug
+from ._camera_registry import CameraRegistry
 from ._track import Track
-from ..tools import Vec3
+from ._world_state import WorldState, WorldPublisher
+
+
+_CONVERT_TIME = metrics.histogram("tracking_convert_seconds")
+_SOLVE_TIME = metrics.histogram("tracking_solve_seconds")
+_MATCH_TIME = metrics.histogram("tracking_match_seconds")
+_SOLVES = metrics.counter("tracking_solves_total")
+_REJECTED = metrics.counter("tracking_rejected_total")
+_GATED = metrics.counter("tracking_gated_total")
+_ACCURACY_BUILD_TIME = metrics.histogram("tracking_accuracy_build_seconds")
 
 
 class TrackingMaster:
-    def __init__(self, data_server: DataServer) -> None:
-        self._tracks: list[Track] = []
-        self._cams: dict[int, SInfData] = {}
+    """
+    turns camera results into tracks
+
+    `update_tracks` may run concurrently for different track ids, but
+    must be called serially for the same track id (see `ComputeStage`)
+
+    with a pool, the expected accuracy of the camera layout is rebuilt
+    in the background after camera changes (see `AccuracyVolume`),
+    assuming an angular error of `angle_error`. Solutions whose accuracy
+    (mean ray distance) is worse than `gate` times the one expected
+    there are dropped. The angular error the solutions actually show is
+    published as `tracking_angle_error_estimate` for calibration.
+    With a `solve_cache`, repeated angle sets skip the solver.
+
+    after every change a new `world` snapshot is published, readers
+    should use it instead of asking the tracker. Tracks without a
+    measurement for `track_timeout` seconds are removed from it.
+    """
+    def __init__(
+            self,
+            data_server: DataServer,
+            pool: ThreadPoolExecutor | None = None,
+            gate: float | None = None,
+            solve_cache: SolveCache | None = None,
+            angle_error: float = 1e-3,
+            track_timeout: float = 5.
+    ) -> None:
+        self._tracks: dict[int, Track] = {}
+        self._cams = CameraRegistry()
         self._ds = data_server
+        self._pool = pool
+        self._gate = gate
+        self._angle_error = angle_error
+        self._solve_cache = solve_cache
+        self._world = WorldPublisher()
+
+        self._track_timeout = track_timeout
+        self._next_expiry = 0.
+
+        self._accuracy: AccuracyVolume | None = None
+        self._accuracy_lock = threading.Lock()
+        self._accuracy_building = False
+        self._accuracy_outdated = False
+
+        # moving average of the angular error derived from the solutions
+        self._angle_error_estimate = 0.
+        metrics.gauge("tracking_angle_error_estimate", lambda: self._angle_error_estimate)
 
         # set tracking master for DataServer
         self._ds.tm = self
 
     @property
     def cams(self) -> list[SInfData]:
-        return list(self._cams.values())
+        return [record.info for record in self._world.current.cams.values()]
+
+    @property
+    def world(self) -> WorldState:
+        self._expire_tracks()
+        return self._world.current
+
+    @property
+    def cams_version(self) -> int:
+        return self._cams.version
+
+    @property
+    def accuracy(self) -> AccuracyVolume | None:
+        """
+        expected accuracy of the latest built camera layout
+        """
+        return self._accuracy
 
     def update_cams(self, cam_update: SInfData) -> None:
         """
         update camera locations
         """
         debugger.log(f"Cam update for cam {cam_update.id}")
-        self._cams[cam_update.id] = cam_update
+
+        # servers resend their stations on reconnect
+        if not self._cams.update(cam_update):
+            return
+
+        self._world.publish_cams(*self._cams.snapshot())
 
         # send update to clients
         self._ds.update_clients(cam_update)
 
-    def update_tracks(self, track_result: TResData) -> None:
+        # cached solutions of older versions can't be hit anymore
+        if self._solve_cache is not None:
+            self._solve_cache.clear()
+
+        if self._pool is not None:
+            self._schedule_accuracy()
+
+    def _schedule_accuracy(self) -> None:
+        """
+        rebuild the accuracy volume, changes during a build are
+        combined into one more build
+        """
+        with self._accuracy_lock:
+            if self._accuracy_building:
+                self._accuracy_outdated = True
+                return
+
+            self._accuracy_building = True
+
+        self._pool.submit(self._build_accuracy)
+
+    @run_with_debug(show_finish=False, reraise_errors=True)
+    @profiler.role("accuracy build")
+    def _build_accuracy(self) -> None:
+        """
+        not meant to be called, should be run in a thread
+        """
+        try:
+            while True:
+                version, cams = self._cams.snapshot()
+
+                with _ACCURACY_BUILD_TIME.time():
+                    self._accuracy = AccuracyVolume.build(
+                        cams.values(), version, angle_error=self._angle_error
+                    )
+
+                debugger.info(f"accuracy volume built for cam version {version}")
+
+                with self._accuracy_lock:
+                    if not self._accuracy_outdated:
+                        return
+
+                    self._accuracy_outdated = False
+
+        finally:
+            with self._accuracy_lock:
+                self._accuracy_building = False
+
+    def update_tracks(self, measurement: Measurement) -> None:
         """
         gets camera data and converts them to tracks
         """
-        # tid = tp.Iterable[CameraResult]
         # add station positions to camera angles
-        debugger.trace(f"matching cam angles, n: {len(track_result.cam_angles)}")
-        debugger.trace(f"currently loaded cams: {self._cams}")
-
-        angles = []
-        for cam_angle in track_result.cam_angles:
-
-            # check if camera was found
-            if cam_angle.cam_id in self._cams:
-                origin = Vec3.from_cartesian(*self._cams[cam_angle.cam_id].position)
-                cam_direction = Vec3.from_cartesian(
-                    *self._cams[cam_angle.cam_id].direction
-                ).normalize()
-
-                # convert angles to 3d Vector
-                direction = Vec3.from_polar(
-                    cam_direction.angle_xy + cam_angle.direction[0],
-                    cam_direction.angle_xz + cam_angle.direction[1],
-                    100
-                )
-
-                angles.append(CameraResult(
-                    origin,
-                    direction
-                ))
-
-        if len(angles) < 2:
+        if __debug__:
+            tracer.trace("matching cam angles, n: {}", len(measurement.cam_ids))
+            tracer.trace("currently loaded cams: {}", len(self._cams))
+
+        start = perf_counter()
+
+        # one consistent set of stations for the whole measurement
+        version, known = self._cams.snapshot()
+
+        # check which cameras are known
+        cams = [
+            (i, known[cam_id]) for i, cam_id in enumerate(measurement.cam_ids)
+            if cam_id in known
+        ]
+
+        if len(cams) < 2:
             debugger.warning("fewer than two valid angles have been found")
+            _REJECTED.inc()
             return
 
+        rows = [i for i, _ in cams]
+        origins = np.array([cam.origin for _, cam in cams])
+        base_angles = np.array([(cam.angle_xy, cam.angle_xz) for _, cam in cams])
+
+        # convert angles to 3d vectors
+        angles = base_angles + measurement.angles[rows]
+        directions = get_backend().polar_to_cartesian(angles[:, 0], angles[:, 1], 100.)
+
+        _CONVERT_TIME.observe(perf_counter() - start)
+
         # calculate 3d Position
-        position, accuracy = solve(*angles)
+        cached = key = None
+        if self._solve_cache is not None:
+            key = self._solve_cache.key(
+                version, measurement.cam_ids[rows], measurement.angles[rows]
+            )
+            cached = self._solve_cache.get(key)
 
-        debugger.log(
-            f"calculated position for track {track_result.track_id}: {position.xyz}"
-        )
+        if cached is not None:
+            position, accuracy = cached
+
+        else:
+            start = perf_counter()
+            try:
+                position, accuracy = solve_rays(origins, directions)
+
+            except ValueError:
+                tracer.emit(f"solve failed for track {measurement.track_id}")
+                raise
+
+            if key is not None:
+                self._solve_cache.put(key, position, accuracy)
+
+            _SOLVE_TIME.observe(perf_counter() - start)
+            _SOLVES.inc()
+
+        # drop solutions far worse than the layout allows there
+        volume = self._accuracy
+        if volume is not None and volume.version == version:
+            expected = volume.expected_residual(position)
+
+            # the residual scales with the angular error
+            if 0 < expected < float("inf"):
+                observed = accuracy / expected * volume.angle_error
+
+                # the lanes share the estimate
+                with self._accuracy_lock:
+                    if self._angle_error_estimate:
+                        observed = self._angle_error_estimate + .01 * (
+                            observed - self._angle_error_estimate
+                        )
+
+                    self._angle_error_estimate = observed
+
+            if self._gate is not None and accuracy > self._gate * expected:
+                if __debug__:
+                    tracer.log("gated track {} with accuracy {}", measurement.track_id, accuracy)
+                _GATED.inc()
+                return
+
+        if __debug__:
+            tracer.log(
+                "calculated position for track {}: {}", measurement.track_id, position
+            )
 
         # match the position to a track
-        track = self.match_pos_track(position, track_result.track_id)
+        start = perf_counter()
+        track = self.match_pos_track(position, measurement.track_id, measurement.time)
+        _MATCH_TIME.observe(perf_counter() - start)
+
+        # publish the new state for readers
+        state = TrackState(
+            measurement.track_id,
+            track.type,
+            position,
+            accuracy,
+            measurement.time,
+            measurement.received,
+            measurement.cam_ids[rows],
+            origins,
+            directions,
+            track.velocity,
+            track.velocity_error
+        )
+        self._world.publish_tracks((state,))
+        self._expire_tracks()
 
         # update clients
-        debugger.trace(f"tracker: updating clients")
-        self._ds.update_clients(TRes3Data(
-            track_id=track_result.track_id,
-            track_type=track.type,
-            position=position.xyz,
-            accuracy=accuracy,
-            cam_angles=[CamAngle3(
-                cam_id=ca.cam_id,
-                position=a.origin.xyz,
-                direction=a.direction.xyz
-            ) for a, ca in zip(angles, track_result.cam_angles)]
-        ))
-        debugger.trace(f"tracker: updated clients")
-
-    def match_pos_track(self, pos: Vec3, tid: int) -> Track:
+        if __debug__:
+            tracer.trace("tracker: updating clients")
+        self._ds.update_clients(state)
+        if __debug__:
+            tracer.trace("tracker: updated clients")
+
+    def _expire_tracks(self) -> None:
+        """
+        forget the tracks that stopped reporting, checked once a second
+        """
+        now = perf_counter()
+        if now < self._next_expiry:
+            return
+
+        self._next_expiry = now + 1.
+
+        for track_id in self._world.expire(now - self._track_timeout):
+            self._tracks.pop(track_id, None)
+
+    def match_pos_track(
+            self,
+            pos: np.ndarray,
+            tid: int,
+            time: float | None = None
+    ) -> Track:
         """
         matches a position to an existing one
         """
-        if len(self._tracks) == 0:
-            t = Track(tid, pos)
-            self._tracks.append(t)
-            return t
+        track = self._tracks.get(tid)
+
+        # a track is only ever updated from its own lane, so no lock is
+        # needed (dict item assignment itself is atomic)
+        if track is None:
+            track = Track(tid, pos, time=time)
+            self._tracks[tid] = track
+            return track
 
-        self._tracks[0].update_position(pos)
-        return self._tracks[0]
+        track.update_position(pos, time)
+        return track
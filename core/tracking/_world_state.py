@@ -0,0 +1,197 @@
+"""
+_world_state.py
+27. January 2025
+
+immutable snapshots of all cameras and tracks
+
+Author:
+Nilusink
+"""
+from types import MappingProxyType
+import typing as tp
+import threading
+
+import numpy as np
+
+from ..maths import CameraRecord, TrackState
+from ..diagnostics import metrics
+
+
+# tracks are spread over this many buckets, a new snapshot only copies
+# the buckets of the tracks that changed
+_BUCKETS: int = 64
+
+_PUBLISH_TIME = metrics.histogram("world_publish_seconds")
+_EXPIRED = metrics.counter("world_expired_tracks_total")
+
+
+class TrackArrays:
+    """
+    the latest state of every track as columns
+    """
+    __slots__ = ("track_ids", "positions", "accuracy", "time")
+
+    def __init__(self, states: list[TrackState]) -> None:
+        self.track_ids = np.array([s.track_id for s in states], dtype=np.int64)
+        self.positions = np.array([s.position for s in states], dtype=np.float64).reshape(-1, 3)
+        self.accuracy = np.array([s.accuracy for s in states], dtype=np.float64)
+        self.time = np.array([s.time for s in states], dtype=np.float64)
+
+
+class WorldState:
+    """
+    cameras and latest track states at one point in time
+
+    never changes once published, so it can be read from any thread
+    without locking. Consecutive snapshots share everything that did
+    not change between them.
+    """
+    __slots__ = ("version", "cams_version", "cams", "_buckets", "_arrays")
+
+    def __init__(
+            self,
+            version: int,
+            cams_version: int,
+            cams: tp.Mapping[int, CameraRecord],
+            buckets: tuple[dict[int, TrackState], ...]
+    ) -> None:
+        self.version = version
+        self.cams_version = cams_version
+        self.cams = cams
+        self._buckets = buckets
+
+        # built on first use, every reader builds the same
+        self._arrays: TrackArrays | None = None
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets)
+
+    def track(self, track_id: int) -> TrackState | None:
+        return self._buckets[track_id % _BUCKETS].get(track_id)
+
+    def tracks(self) -> tp.Iterator[TrackState]:
+        for bucket in self._buckets:
+            yield from bucket.values()
+
+    def arrays(self) -> TrackArrays:
+        if self._arrays is None:
+            self._arrays = TrackArrays(list(self.tracks()))
+
+        return self._arrays
+
+
+class WorldPublisher:
+    """
+    builds and publishes a new `WorldState` for every change, readers
+    take `current` and keep using it for as long as they need
+    """
+    def __init__(self) -> None:
+        self._current = WorldState(
+            0, 0, MappingProxyType({}), tuple({} for _ in range(_BUCKETS))
+        )
+
+        # writers are serialized, readers never take it
+        self._lock = threading.Lock()
+
+        metrics.gauge("world_version", lambda: self._current.version)
+
+    @property
+    def current(self) -> WorldState:
+        return self._current
+
+    def publish_tracks(self, states: tp.Iterable[TrackState]) -> WorldState:
+        """
+        publish the new states of some tracks
+        """
+        with _PUBLISH_TIME.time(), self._lock:
+            current = self._current
+            buckets = list(current._buckets)
+
+            copied: set[int] = set()
+            for state in states:
+                index = state.track_id % _BUCKETS
+
+                if index not in copied:
+                    buckets[index] = dict(buckets[index])
+                    copied.add(index)
+
+                buckets[index][state.track_id] = state
+
+            world = self._current = WorldState(
+                current.version + 1,
+                current.cams_version,
+                current.cams,
+                tuple(buckets)
+            )
+
+        return world
+
+    def remove_tracks(self, track_ids: tp.Iterable[int]) -> WorldState:
+        """
+        publish a state without the given tracks
+        """
+        with _PUBLISH_TIME.time(), self._lock:
+            return self._remove(set(track_ids))
+
+    def expire(self, oldest: float) -> set[int]:
+        """
+        publish a state without the tracks last received before `oldest`,
+        returns their ids
+        """
+        with _PUBLISH_TIME.time(), self._lock:
+            track_ids = {
+                state.track_id for state in self._current.tracks()
+                if state.received < oldest
+            }
+            self._remove(track_ids)
+
+        return track_ids
+
+    def _remove(self, track_ids: set[int]) -> WorldState:
+        current = self._current
+        buckets = list(current._buckets)
+
+        removed = 0
+        for track_id in track_ids:
+            index = track_id % _BUCKETS
+            if track_id not in buckets[index]:
+                continue
+
+            if buckets[index] is current._buckets[index]:
+                buckets[index] = dict(buckets[index])
+
+            del buckets[index][track_id]
+            removed += 1
+
+        if not removed:
+            return current
+
+        _EXPIRED.inc(removed)
+        world = self._current = WorldState(
+            current.version + 1,
+            current.cams_version,
+            current.cams,
+            tuple(buckets)
+        )
+
+        return world
+
+    def publish_cams(self, cams_version: int, cams: tp.Mapping[int, CameraRecord]) -> WorldState:
+        """
+        publish a new camera configuration, `cams` must not change anymore
+        """
+        with _PUBLISH_TIME.time(), self._lock:
+            current = self._current
+
+            # configurations may be published out of order
+            if cams_version <= current.cams_version:
+                return current
+
+            world = self._current = WorldState(
+                current.version + 1,
+                cams_version,
+                cams,
+                current._buckets
+            )
+
+        return world
@@ -7,14 +7,64 @@ Converts three camera angles to one 3-dimensional point
 Author:
 Nilusink
 """
-from core import DataClient, TrackingMaster, debugger, DebugLevel, DataServer
+from core import DataClientGroup, TrackingMaster, debugger, DebugLevel, DataServer
+from core import MetricsServer, ShardedTrackingMaster, ComputeStage, FrameAssembler
+from core import tracer, HistoryStore, HistoryWriter, SolveCache, profiler
+from core import select_backend
 from concurrent.futures import ThreadPoolExecutor
+import signal
 from time import perf_counter
 from icecream import ic
 
 
-SERVER_ADDR: tuple[str, int] = ("127.0.0.1", 10_000)
+# upstream camera servers, camera ids are offset by CAM_ID_STRIDE per server
+SERVER_ADDRS: list[tuple[str, int]] = [
+    ("127.0.0.1", 10_000),
+]
 DATA_SERVER_ADDR: tuple[str, int] = ("127.0.0.1", 20_000)
+METRICS_ADDR: tuple[str, int] = ("127.0.0.1", 20_100)
+
+# SIGUSR2 starts the sampling profiler, the next one writes the stacks
+# (also available at METRICS_ADDR /profile/start and /profile/stop)
+PROFILE_PATH: str = "./profile.folded"
+
+# kernels of the solver ("numpy", "numba" or "auto": numba if installed)
+COMPUTE_BACKEND: str = "auto"
+
+# number of tracking worker processes, 0 runs the tracking in this process
+TRACKING_SHARDS: int = 0
+
+# solutions worse than ACCURACY_GATE times the accuracy expected from
+# the camera layout are dropped (only without shards), None disables it
+ACCURACY_GATE: float | None = None
+
+# angular error of the cameras (radians), calibrate with the
+# tracking_angle_error_estimate metric before enabling the gate
+ANGLE_ERROR: float = 1e-3
+
+# solutions of repeated (quantized) camera angles, 0 disables the cache
+SOLVE_CACHE_SIZE: int = 4096
+
+# tracking compute stage, results beyond the queue limit are shed
+TRACKING_WORKERS: int = 4
+TRACKING_QUEUE: int = 256
+
+# measurements are grouped by capture time, incomplete frames are
+# released after FRAME_LATENCY seconds (in capture time)
+FRAME_TOLERANCE: float = .02
+FRAME_LATENCY: float = .1
+
+# solved positions kept for history requests of the clients (seconds)
+HISTORY_RETENTION: float = 600.
+
+# extrapolate sent positions by the time they spent in the pipeline
+PREDICT_POSITIONS: bool = True
+
+# maximum position error of the stored (simplified) trajectories
+HISTORY_TOLERANCE: float = .05
+
+# sealed history blocks are written here, see `core.load_history`
+HISTORY_DIR: str = "./history"
 
 
 def main():
@@ -34,33 +84,100 @@ def main():
     ic.configureOutput(prefix=time_since_start)
     debugger.init("./tracking.log", write_debug=False, debug_level=DebugLevel.info)
 
-    # threading stuff
-    pool = ThreadPoolExecutor()
+    if hasattr(signal, "SIGUSR2"):
+        signal.signal(signal.SIGUSR2, lambda *_: profiler.toggle(PROFILE_PATH))
+
+    # before the shards are forked, so they inherit it
+    select_backend(COMPUTE_BACKEND)
+
+    # short background tasks, every long running loop has its own thread
+    pool = ThreadPoolExecutor(thread_name_prefix="io")
+
+    history_writer = HistoryWriter(HISTORY_DIR, pool)
+    history = HistoryStore(
+        HISTORY_RETENTION,
+        on_seal=history_writer.submit,
+        tolerance=HISTORY_TOLERANCE
+    )
 
     ds = DataServer(
         DATA_SERVER_ADDR,
+        pool,
+        history=history,
+        predict=PREDICT_POSITIONS
+    )
+
+    # pipeline instrumentation
+    ms = MetricsServer(
+        METRICS_ADDR,
         pool
     )
 
     # tracks
-    tm = TrackingMaster(ds)
+    if TRACKING_SHARDS > 0:
+        tm = ShardedTrackingMaster(ds, pool, TRACKING_SHARDS)
+
+        # shards are forked, so they have to be started before any threads
+        tm.start()
+
+    else:
+        tm = TrackingMaster(
+            ds,
+            pool,
+            gate=ACCURACY_GATE,
+            solve_cache=SolveCache(SOLVE_CACHE_SIZE) if SOLVE_CACHE_SIZE > 0 else None,
+            angle_error=ANGLE_ERROR
+        )
+
+    # bounded compute stage between receiving and tracking
+    tracking = ComputeStage(
+        "tracking",
+        tm.update_tracks,
+        key=lambda result: result.track_id,
+        workers=TRACKING_WORKERS,
+        max_pending=TRACKING_QUEUE
+    )
+
+    # time aligned frames of all cameras
+    frames = FrameAssembler(
+        tracking.submit_many,
+        tolerance=FRAME_TOLERANCE,
+        max_latency=FRAME_LATENCY
+    )
 
     # start socket stuff
-    dc = DataClient(
-        SERVER_ADDR,
-        tm.update_tracks,
+    dc = DataClientGroup(
+        SERVER_ADDRS,
+        frames.add,
         tm.update_cams,
-        pool
+        pool,
+        on_receive_tres_batch_callback=frames.add_many
     )
 
     # start program
+    tracking.start()
+    history_writer.start()
     dc.start()
     ds.start()
+    ms.start()
 
     input("press enter to stop")
 
     dc.stop()
+    tracking.stop()
     ds.stop()
+    ms.stop()
+
+    # write the remaining history, `ds.stop` has joined the update loop
+    # (the only thread adding to it)
+    history.flush()
+    history_writer.stop()
+
+    if TRACKING_SHARDS > 0:
+        tm.stop()
+
+    # keep the last hot path events for post-mortem analysis
+    tracer.write("./trace.log")
 
     debugger.trace("shutting down threadpool")
     pool.shutdown(wait=True)
@@ -0,0 +1,97 @@
+"""
+test_backends.py
+02. February 2025
+
+every available compute backend must agree with the numpy reference
+
+Author:
+Nilusink
+"""
+import numpy as np
+import pytest
+
+from core.maths import select_backend, get_backend, available_backends, solve_rays
+from core.maths._solve import distance_to_line
+
+
+BACKENDS: list[str] = available_backends()
+
+
+@pytest.fixture(autouse=True)
+def _restore_backend():
+    previous = get_backend().name
+    yield
+    select_backend(previous)
+
+
+def random_rays(rng: np.random.Generator, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    noisy rays from the ground towards a target at roughly 100 m
+    """
+    target = rng.uniform(-100, 100, 3) + (0, 0, 100)
+    origins = rng.uniform(-50, 50, (n, 3)) * (1, 1, 0)
+    directions = target - origins + rng.normal(0, .5, (n, 3))
+    return origins, directions
+
+
+def test_numpy_is_available():
+    assert "numpy" in BACKENDS
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        select_backend("unknown")
+
+
+def test_numba_backend():
+    pytest.importorskip("numba")
+
+    assert "numba" in BACKENDS
+    assert select_backend("auto").name == "numba"
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+@pytest.mark.parametrize("n", [2, 3, 8])
+def test_polar_to_cartesian(name: str, n: int):
+    rng = np.random.default_rng(n)
+    angles = rng.uniform(-np.pi, np.pi, (n, 2))
+
+    expected = select_backend("numpy").polar_to_cartesian(angles[:, 0], angles[:, 1], 100.)
+    result = select_backend(name).polar_to_cartesian(angles[:, 0], angles[:, 1], 100.)
+
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+@pytest.mark.parametrize("n", [2, 3, 8])
+def test_line_distances(name: str, n: int):
+    rng = np.random.default_rng(n)
+    origins, directions = random_rays(rng, n)
+    point = rng.uniform(-100, 100, 3)
+
+    # the per line helper is the ground truth
+    expected = [distance_to_line(point, o, d) for o, d in zip(origins, directions)]
+    backend = select_backend(name)
+
+    np.testing.assert_allclose(
+        backend.line_distances(point, origins, directions), expected, rtol=1e-9
+    )
+    np.testing.assert_allclose(
+        backend.objective(point, origins, directions), sum(expected), rtol=1e-9
+    )
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+@pytest.mark.parametrize("n", [2, 3, 8])
+def test_solve_rays(name: str, n: int):
+    rng = np.random.default_rng(n)
+    origins, directions = random_rays(rng, n)
+
+    select_backend("numpy")
+    expected_position, expected_accuracy = solve_rays(origins, directions)
+
+    select_backend(name)
+    position, accuracy = solve_rays(origins, directions)
+
+    np.testing.assert_allclose(position, expected_position, atol=1e-4)
+    assert accuracy == pytest.approx(expected_accuracy, abs=1e-4)
@@ -0,0 +1,113 @@
+"""
+test_frame_assembler.py
+04. February 2025
+
+camera measurements are joined into frames and released in capture order
+
+Author:
+Nilusink
+"""
+import numpy as np
+import pytest
+
+from core.maths import Measurement
+from core.tracking import FrameAssembler
+
+
+def measurement(track_id: int, time: float, cam_ids: list[int], angle: float = 0.) -> Measurement:
+    return Measurement(
+        track_id,
+        time,
+        np.array(cam_ids, dtype=np.int64),
+        np.full((len(cam_ids), 2), angle),
+        received=0.
+    )
+
+
+@pytest.fixture
+def released() -> list[Measurement]:
+    return []
+
+
+@pytest.fixture
+def assembler(released: list[Measurement]) -> FrameAssembler:
+    return FrameAssembler(released.extend, tolerance=.02, max_latency=.1)
+
+
+def test_complete_measurement_is_passed_on(assembler, released):
+    m = measurement(1, 0., [0, 1])
+    assembler.add(m)
+
+    assert released == [m]
+
+
+def test_cameras_are_joined(assembler, released):
+    assembler.add(measurement(1, 0., [0, 1]))
+    assembler.add(measurement(1, .1, [0]))
+    assembler.add(measurement(1, .105, [1]))
+
+    assert [(m.time, m.cam_ids.tolist()) for m in released] == [
+        (0., [0, 1]),
+        (.1, [0, 1]),
+    ]
+
+
+def test_single_camera_frames_are_dropped(assembler, released):
+    assembler.add(measurement(1, 0., [0]))
+    assembler.add(measurement(2, 1., [0, 1]))
+
+    assert [m.track_id for m in released] == [2]
+
+
+def test_first_cameras_of_a_track_are_joined(assembler, released):
+    # independent stations, the second camera reports shortly after
+    assembler.add(measurement(1, 0., [0]))
+    assembler.add(measurement(1, .001, [1]))
+
+    assert [m.cam_ids.tolist() for m in released] == [[0, 1]]
+
+
+def test_late_measurements_are_dropped(assembler, released):
+    for time in (0., .05, .1, .15, .07):
+        assembler.add(measurement(1, time, [0, 1]))
+
+    assert [m.time for m in released] == [0., .05, .1, .15]
+
+
+def test_released_in_capture_order(assembler, released):
+    rng = np.random.default_rng(0)
+    times = np.arange(0, 2, .01)
+    times = times + rng.uniform(0, .05, len(times))
+
+    for time in times:
+        assembler.add(measurement(1, float(time), [int(rng.integers(2))]))
+        assembler.add(measurement(1, float(time) + .001, [0, 1]))
+
+    released_times = [m.time for m in released]
+    assert released_times == sorted(released_times)
+
+
+def test_idle_tracks_time_out(assembler, released):
+    # camera 1 stops reporting track 1, the frame is incomplete
+    assembler.add(measurement(1, 0., [0, 1]))
+    assembler.add(measurement(1, .05, [0]))
+
+    # only other tracks keep reporting
+    for time in np.arange(.06, .4, .01):
+        assembler.add(measurement(2, float(time), [0, 1]))
+
+    assert [m.time for m in released if m.track_id == 1] == [0.]
+    assert all(m.track_id == 2 for m in released[1:])
+    assert not assembler._tracks[1].frames
+
+
+def test_missing_angles_are_interpolated(assembler, released):
+    assembler.add(measurement(1, 0., [0, 1], angle=0.))
+    assembler.add(measurement(1, .05, [0], angle=.5))
+    assembler.add(measurement(1, .1, [0, 1], angle=1.))
+
+    assert [m.time for m in released] == [0., .05, .1]
+
+    frame = released[1]
+    assert frame.cam_ids.tolist() == [0, 1]
+    np.testing.assert_allclose(frame.angles, .5)
@@ -0,0 +1,91 @@
+"""
+test_history_store.py
+04. February 2025
+
+stored positions are queried per track and by area, in capture order
+
+Author:
+Nilusink
+"""
+import numpy as np
+import pytest
+
+from core.history import HistoryStore
+from core.maths import TrackState
+
+
+def state(track_id: int, time: float, position=(0., 0., 0.)) -> TrackState:
+    return TrackState(
+        track_id,
+        0,
+        np.array(position, dtype=np.float64),
+        .1,
+        time,
+        received=time,
+        cam_ids=np.array([0, 1]),
+        origins=np.zeros((2, 3)),
+        directions=np.ones((2, 3)),
+    )
+
+
+@pytest.fixture
+def store() -> HistoryStore:
+    return HistoryStore(retention=60., block_seconds=1., block_capacity=64)
+
+
+def test_track_query(store):
+    for time in np.arange(0, 5, .1):
+        store.add(state(1, float(time)))
+        store.add(state(2, float(time)))
+
+    samples = store.track(1, 1., 2.)
+
+    assert np.all(samples.track_ids == 1)
+    np.testing.assert_allclose(samples.time, np.arange(1, 2.05, .1))
+
+
+def test_late_samples_are_dropped(store):
+    rng = np.random.default_rng(0)
+    times = np.arange(0, 20, .1) + rng.uniform(0, .3, 200)
+
+    for time in times:
+        store.add(state(1, float(time), (time, 0., 0.)))
+
+    # only samples newer than every sample before them are kept
+    kept = times[times >= np.maximum.accumulate(times)]
+
+    for t0, t1 in rng.uniform(0, 20, (50, 2)):
+        t0, t1 = sorted((float(t0), float(t1)))
+        samples = store.track(1, t0, t1)
+
+        expected = kept[(kept >= t0) & (kept <= t1)]
+        np.testing.assert_array_equal(samples.time, expected)
+        np.testing.assert_array_equal(samples.positions[:, 0], expected)
+
+    np.testing.assert_array_equal(store.track(1, 0., 25.).time, kept)
+
+
+def test_bbox_query(store):
+    for time in (i / 10 for i in range(50)):
+        store.add(state(1, time, (time, 0., 0.)))
+        store.add(state(2, time, (0., time, 0.)))
+
+    samples = store.bbox((1., -.5, -.5), (2., .5, .5), 0.)
+
+    assert np.all(samples.track_ids == 1)
+    assert np.all(np.diff(samples.time) >= 0)
+    np.testing.assert_allclose(samples.positions[:, 0], samples.time)
+    assert len(samples) == 11
+
+
+def test_simplified_late_samples_are_dropped():
+    store = HistoryStore(block_seconds=1., tolerance=.01)
+
+    for time in (0., 1., 2., 1.5, 3., 4.):
+        store.add(state(1, time, (time, 0., 0.)))
+
+    store.flush()
+
+    samples = store.track(1, 0., 5.)
+    assert np.all(np.diff(samples.time) > 0)
+    assert 1.5 not in samples.time
@@ -0,0 +1,103 @@
+"""
+test_pending_replies.py
+04. February 2025
+
+pending replies are matched, expired and cancelled
+
+Author:
+Nilusink
+"""
+from time import perf_counter
+import threading
+
+import pytest
+
+from core.comms import PendingReplies, reply_status, TIMEOUT_ID, CANCELLED_ID
+from core.diagnostics import Histogram
+from core.tools.comms import prepare_message, AckData, AckMessage
+
+
+@pytest.fixture
+def replies() -> PendingReplies:
+    return PendingReplies("test", timeout=1.)
+
+
+def send(replies: PendingReplies, owner=None):
+    _, future = prepare_message(
+        AckData(to=0, ack=True),
+        lambda f: replies.add(f, owner)
+    )
+    return future
+
+
+def test_pop_matches_the_owner(replies):
+    future = send(replies, "a")
+    message_id = future.origin_message.id
+
+    assert replies.pop(message_id, "b") is None
+    assert replies.pop(message_id, "a") is future
+    assert replies.pop(message_id, "a") is None
+    assert len(replies) == 0
+
+
+def test_latency_is_recorded():
+    latency = Histogram("test_reply_seconds")
+    replies = PendingReplies("test_latency", latency=latency)
+
+    future = send(replies)
+    replies.pop(future.origin_message.id)
+
+    assert latency.snapshot()["count"] == 1
+
+
+def test_expired_entries_time_out(replies):
+    future = send(replies, "a")
+    kept = send(replies, "a")
+    replies.pop(kept.origin_message.id, "a")
+
+    assert replies.expire(perf_counter() + 2.) == 1
+    assert len(replies) == 0
+
+    assert future.message.id == TIMEOUT_ID
+    assert future.message.data.to == future.origin_message.id
+    assert reply_status(future) == "timeout"
+    assert reply_status(kept) is None
+
+
+def test_cancel_completes_the_futures(replies):
+    futures = [send(replies, "a") for _ in range(3)]
+    other = send(replies, "b")
+
+    assert replies.cancel("a") == 3
+    assert replies.cancel("a") == 0
+    assert len(replies) == 1
+
+    for future in futures:
+        assert future.message.id == CANCELLED_ID
+        assert reply_status(future) == "cancelled"
+
+    # heap entries of the cancelled group are skipped
+    assert replies.expire(perf_counter() + 2.) == 1
+    assert reply_status(other) == "timeout"
+
+
+def test_cancel_releases_waiting_threads(replies):
+    future = send(replies, "a")
+
+    waiter = threading.Thread(target=future.wait_until_done, args=(.001, 5.))
+    waiter.start()
+
+    start = perf_counter()
+    replies.cancel("a")
+    waiter.join()
+
+    assert perf_counter() - start < 1.
+
+
+def test_replies_are_not_timeouts(replies):
+    future = send(replies)
+    future.message = AckMessage(
+        type="ack", id=5, time=0., data=AckData(to=future.origin_message.id, ack=False)
+    )
+
+    assert reply_status(future) == "nack"
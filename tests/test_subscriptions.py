@@ -0,0 +1,95 @@
+"""
+test_subscriptions.py
+04. February 2025
+
+track updates are matched to the subscribed clients and rate limited
+
+Author:
+Nilusink
+"""
+import numpy as np
+import pytest
+
+from core.comms import SubscriptionQuery, SubscriptionIndex
+from core.maths import TrackState
+from core.tools.comms import TRes3Data
+
+
+def update(track_id: int, position=(0., 0., 0.)) -> TRes3Data:
+    return TrackState(
+        track_id,
+        0,
+        np.array(position, dtype=np.float64),
+        .1,
+        0.,
+        received=0.,
+        cam_ids=np.array([0, 1]),
+        origins=np.zeros((2, 3)),
+        directions=np.ones((2, 3)),
+    ).to_message()
+
+
+@pytest.fixture
+def index() -> SubscriptionIndex:
+    return SubscriptionIndex(cell_size=10.)
+
+
+def test_filters(index):
+    index.subscribe("all")
+    index.subscribe("box", SubscriptionQuery(bbox=((0, 0, 0), (20, 20, 20))))
+    index.subscribe("track", SubscriptionQuery(track_ids=[2]))
+
+    assert {c for c, _ in index.match(update(1, (5, 5, 5)), 0.)} == {"all", "box"}
+    assert {c for c, _ in index.match(update(2, (50, 5, 5)), 0.)} == {"all", "track"}
+
+    index.remove("all")
+    assert index.match(update(1, (50, 5, 5)), 0.) == []
+
+
+def test_fields_keep_the_discriminator_and_track_id(index):
+    index.subscribe("a", SubscriptionQuery(fields=["position"]))
+
+    (_, exclude), = index.match(update(1), 0.)
+
+    assert {"type", "track_id", "position"}.isdisjoint(exclude)
+    assert "accuracy" in exclude
+
+
+def test_rate_limited_updates_are_deferred(index):
+    index.subscribe("a", SubscriptionQuery(max_rate=10))
+
+    first, second, third = update(1), update(1), update(1)
+    assert len(index.match(first, 0.)) == 1
+    assert index.match(second, .02) == []
+    assert index.match(third, .05) == []
+
+    # the newest held back update is sent once the interval passed
+    assert index.flush(.08) == []
+    (client, sent, _), = index.flush(.1)
+    assert client == "a" and sent is third
+
+    assert index.flush(.3) == []
+    assert index.match(update(1), .3) != []
+
+
+def test_sent_updates_replace_deferred_ones(index):
+    index.subscribe("a", SubscriptionQuery(max_rate=10))
+
+    index.match(update(1), 0.)
+    index.match(update(1), .05)
+    assert len(index.match(update(1), .15)) == 1
+
+    assert index.flush(.2) == []
+
+
+def test_idle_tracks_are_forgotten(index):
+    index.subscribe("a", SubscriptionQuery(max_rate=10))
+    index.subscribe("b")
+
+    for track_id in range(1000):
+        index.match(update(track_id), 0.)
+
+    index.flush(1.)
+
+    assert not index._subscriptions["a"].last_sent
+    assert not index._subscriptions["b"].last_sent
@@ -0,0 +1,64 @@
+"""
+test_world_state.py
+04. February 2025
+
+published world states never change and drop tracks that stopped reporting
+
+Author:
+Nilusink
+"""
+import numpy as np
+import pytest
+
+from core.maths import TrackState
+from core.tracking import WorldPublisher
+
+
+def state(track_id: int, received: float) -> TrackState:
+    return TrackState(
+        track_id,
+        0,
+        np.zeros(3),
+        .1,
+        received,
+        received=received,
+        cam_ids=np.array([0, 1]),
+        origins=np.zeros((2, 3)),
+        directions=np.ones((2, 3)),
+    )
+
+
+@pytest.fixture
+def publisher() -> WorldPublisher:
+    return WorldPublisher()
+
+
+def test_published_states_dont_change(publisher):
+    first = publisher.publish_tracks([state(1, 0.)])
+    second = publisher.publish_tracks([state(2, 0.)])
+
+    assert len(first) == 1 and len(second) == 2
+    assert second.version == first.version + 1
+
+
+def test_remove_tracks(publisher):
+    before = publisher.publish_tracks([state(i, 0.) for i in range(200)])
+    after = publisher.remove_tracks([3, 67, 500])
+
+    assert len(before) == 200
+    assert len(after) == 198
+    assert after.track(3) is None and after.track(67) is None
+    assert after.track(131) is not None
+
+    # nothing to remove, nothing published
+    assert publisher.remove_tracks([3]) is after
+
+
+def test_expire(publisher):
+    publisher.publish_tracks([state(1, 0.), state(2, 5.), state(3, 10.)])
+
+    assert publisher.expire(6.) == {1, 2}
+    assert [s.track_id for s in publisher.current.tracks()] == [3]
+    np.testing.assert_array_equal(publisher.current.arrays().track_ids, [3])
+
+    assert publisher.expire(6.) == set()